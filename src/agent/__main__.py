@@ -1,9 +1,21 @@
 import logging
+import sys
+import time
 from .agent import Agent
 
 try:
+    started_at = time.perf_counter()
     agent = Agent()
+
+    # Only report how long startup took, e.g. to spot startup regressions
+    if "--benchmark" in sys.argv[1:]:
+        print(f"{'':<10}{'import':>10}{'ready':>10}")
+        for name, times in agent.startup_times.items():
+            print(f"{name:<10}{times['import']:>9.3f}s{times['ready']:>9.3f}s")
+        print(f"{'total':<10}{'':>10}{time.perf_counter() - started_at:>9.3f}s")
+        exit()
+
     agent.run()
 except KeyboardInterrupt:
     logging.info("[AGENT] Agent shutting down...")
-    exit()
\ No newline at end of file
+    exit()
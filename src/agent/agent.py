@@ -1,8 +1,15 @@
+import asyncio
 import logging
+import multiprocessing
 import os
+import signal
+import sys
+import tempfile
 import threading
+import time
 import importlib
 import pkgutil
+from concurrent.futures import ThreadPoolExecutor
 from . import agent_tools
 from dotenv import load_dotenv
 from .agent_config import AgentConfig
@@ -10,8 +17,12 @@ from .agent_config import AgentConfig
 logger = logging.getLogger(__name__)
 logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
 
+# A worker process that stayed up for this many seconds is considered healthy
+# again, which resets its restart backoff
+WORKER_STABLE_SECONDS = 5 * 60
+
 class Agent:
-    def __init__(self):
+    def __init__(self, model=None, tool_names=None):
         logger.info("[AGENT] Initializing agent...")
         
         # Load environment variables
@@ -20,53 +31,109 @@ class Agent:
         # Load config
         self.config = AgentConfig()
 
+        # Seconds it took to import and to initialize the model and each tool
+        self.startup_times = {}
+
         # Initialize model (done separately because it's used by other tools)
-        from .agent_tools.model.model import Model
-        self.model = Model(
-            api_key=os.getenv("MODEL_API_KEY")
-        )
+        if model is None:
+            started_at = time.perf_counter()
+            from .agent_tools.model.model import Model
+            imported_at = time.perf_counter()
+            model = Model(
+                api_key=os.getenv("MODEL_API_KEY")
+            )
+            self.startup_times["model"] = {
+                "import": imported_at - started_at,
+                "ready": time.perf_counter() - started_at
+            }
+        self.model = model
 
-        # Load and initialize tools
+        # Load and initialize tools (in worker process mode each tool is
+        # loaded by its own worker process instead)
         self.tools = {}
-        self.__load_tools()
+        if self.config.RUNTIME != "processes" or tool_names is not None:
+            self.__load_tools(tool_names)
 
 
-    def __load_tools(self):
-        """Automatically load all tools from the agent_tools directory."""
+    def __tool_names(self):
+        """
+        Returns the names of the tools in the agent_tools directory that are
+        enabled in the agent config, without importing them.
+        """
+        return [
+            name
+            for _, name, _ in pkgutil.iter_modules(agent_tools.__path__)
+            # Skip model module because it's handled separately
+            if name != 'model' and getattr(self.config, f"{name.upper()}_ENABLED", False)
+        ]
+
+
+    def __load_tools(self, tool_names=None):
+        """
+        Automatically load all enabled tools from the agent_tools directory.
+        Tools are loaded in parallel because their initialization may wait on
+        the network (e.g. Twitter looks up the authenticated user).
+        """
         
         logger.info(f"[AGENT] Loading agent tools...")
-        for _, name, _ in pkgutil.iter_modules(agent_tools.__path__):
-            # Skip model module because it's handled separately
-            if name == 'model':
-                continue
+        names = [
+            name for name in self.__tool_names()
+            if tool_names is None or name in tool_names
+        ]
+        if not names:
+            return
 
-            try:
-                logger.info(f"[AGENT] Loading {name} tool...")
-                # Import module
-                module = importlib.import_module(f".agent_tools.{name}.{name}", package=__package__)
-                
-                # Get main class (assumed to be capitalized version of the module name)
-                tool_class = getattr(module, name.capitalize())
-                
-                # Check if tool is enabled in agent config
-                if getattr(self.config, f"{name.upper()}_ENABLED", False):
-                    # Get required environment variables
-                    env_vars = {
-                        key.replace(f"{name.upper()}_", "").lower(): os.getenv(key)
-                        for key in os.environ
-                        if key.startswith(f"{name.upper()}_")
-                    }
-                    
-                    # Initialize tool with environment variables and model
-                    self.tools[name] = tool_class(**env_vars, model=self.model)
-                    logger.info(f"[AGENT] Loaded {name} tool.")
-            except Exception as e:
-                logger.error(f"[AGENT] Failed to load {name} tool. Error: {str(e)}.")
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            for name, tool in zip(names, executor.map(self.__load_tool, names)):
+                if tool is not None:
+                    self.tools[name] = tool
+
+
+    def __load_tool(self, name):
+        """Imports and initializes a single tool, and records how long it took."""
+        try:
+            logger.info(f"[AGENT] Loading {name} tool...")
+            started_at = time.perf_counter()
+
+            # Import module
+            module = importlib.import_module(f".agent_tools.{name}.{name}", package=__package__)
+            imported_at = time.perf_counter()
+            
+            # Get main class (assumed to be capitalized version of the module name)
+            tool_class = getattr(module, name.capitalize())
+
+            # Get required environment variables
+            env_vars = {
+                key.replace(f"{name.upper()}_", "").lower(): os.getenv(key)
+                for key in os.environ
+                if key.startswith(f"{name.upper()}_")
+            }
+            
+            # Initialize tool with environment variables and model
+            tool = tool_class(**env_vars, model=self.model)
+            ready_at = time.perf_counter()
+
+            self.startup_times[name] = {
+                "import": imported_at - started_at,
+                "ready": ready_at - started_at
+            }
+            logger.info(f"[AGENT] Loaded {name} tool in {ready_at - started_at:.2f}s (import {imported_at - started_at:.2f}s).")
+            return tool
+        except Exception as e:
+            logger.error(f"[AGENT] Failed to load {name} tool. Error: {str(e)}.")
+            return None
 
 
     def run(self):
         """Run the agent and all enabled tools."""
 
+        if self.config.RUNTIME == "async":
+            asyncio.run(self.run_async())
+            return
+        if self.config.RUNTIME == "processes":
+            asyncio.run(self.run_processes())
+            return
+
         logger.info("[AGENT] Running agent...")
 
         # Start each tool in a separate thread
@@ -83,4 +150,166 @@ class Agent:
 
         # Wait for all threads to finish
         for thread in threads:
-            thread.join()
\ No newline at end of file
+            thread.join()
+
+
+    async def run_async(self):
+        """
+        Run the agent and all enabled tools on a single event loop. Tools that
+        don't support it (no `start` coroutine) are run in a worker thread.
+        On SIGINT or SIGTERM tools are stopped and given `SHUTDOWN_TIMEOUT`
+        seconds to finish their work.
+        """
+
+        logger.info("[AGENT] Running agent...")
+        loop = asyncio.get_running_loop()
+        stop_event = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+        tasks = {}
+        logger.info(f"[AGENT] Running agent tools...")
+        for name, tool in self.tools.items():
+            if hasattr(tool, "start"):
+                tasks[name] = asyncio.create_task(tool.start(), name=name)
+            else:
+                tasks[name] = asyncio.create_task(asyncio.to_thread(tool.run), name=name)
+            logger.info(f"[AGENT] Running {name} tool...")
+
+        # Wait for a shutdown signal, or for every tool to finish. Only tools
+        # that are still running are waited for, and a tool that fails is
+        # reported as soon as it does
+        stopping = asyncio.create_task(stop_event.wait())
+        running = set(tasks.values())
+        while running and not stop_event.is_set():
+            done, _ = await asyncio.wait({stopping, *running}, return_when=asyncio.FIRST_COMPLETED)
+            for task in done - {stopping}:
+                running.discard(task)
+                if not task.cancelled() and task.exception():
+                    logger.error(f"[AGENT] {task.get_name()} tool failed. Error: {str(task.exception())}.")
+        stopping.cancel()
+
+        logger.info("[AGENT] Agent shutting down...")
+        for name, tool in self.tools.items():
+            if hasattr(tool, "stop"):
+                try:
+                    await tool.stop()
+                except Exception as e:
+                    logger.error(f"[AGENT] Failed to stop {name} tool. Error: {str(e)}.")
+
+        pending = [task for task in tasks.values() if not task.done()]
+        if pending:
+            _, pending = await asyncio.wait(pending, timeout=self.config.SHUTDOWN_TIMEOUT)
+        for task in pending:
+            logger.warning(f"[AGENT] {task.get_name()} tool did not stop in time.")
+            task.cancel()
+
+        await self.model.aclose()
+
+
+    async def run_processes(self):
+        """
+        Run each enabled tool in its own worker process. Workers share this
+        process' model through a model gateway on a Unix socket, and are
+        restarted with exponential backoff when they fail. On SIGINT or
+        SIGTERM workers are stopped and given `SHUTDOWN_TIMEOUT` seconds to
+        finish their work.
+        """
+        from .agent_tools.model.model_gateway import ModelGateway
+
+        logger.info("[AGENT] Running agent...")
+        loop = asyncio.get_running_loop()
+        stop_event = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+        gateway_path = self.config.MODEL_GATEWAY_PATH or os.path.join(
+            tempfile.gettempdir(), f"agent-model-{os.getpid()}.sock"
+        )
+        gateway = ModelGateway(self.model, gateway_path)
+        await gateway.start()
+
+        # Tools are spawned rather than forked, a fork would copy this
+        # process' event loop and threads
+        context = multiprocessing.get_context("spawn")
+        logger.info(f"[AGENT] Running agent tools...")
+        supervisors = [
+            asyncio.create_task(self.__supervise(name, context, gateway_path, stop_event))
+            for name in self.__tool_names()
+        ]
+        await asyncio.gather(*supervisors)
+
+        logger.info("[AGENT] Agent shutting down...")
+        await gateway.close()
+        await self.model.aclose()
+
+
+    async def __supervise(self, name, context, gateway_path, stop_event):
+        """Runs a tool's worker process and restarts it whenever it fails."""
+        loop = asyncio.get_running_loop()
+        failures = 0
+        while not stop_event.is_set():
+            process = context.Process(
+                target=run_worker,
+                args=(name, gateway_path),
+                name=f"agent-{name}"
+            )
+            process.start()
+            started_at = loop.time()
+            logger.info(f"[AGENT] Running {name} tool in process {process.pid}...")
+
+            while process.is_alive() and not await _wait_for_event(stop_event, 1):
+                pass
+
+            if stop_event.is_set():
+                await self.__stop_process(name, process)
+                return
+            if process.exitcode == 0:
+                logger.info(f"[AGENT] {name} tool finished.")
+                return
+
+            if loop.time() - started_at > WORKER_STABLE_SECONDS:
+                failures = 0
+            failures += 1
+            backoff = min(
+                self.config.WORKER_RESTART_BACKOFF_MAX,
+                self.config.WORKER_RESTART_BACKOFF * 2 ** (failures - 1)
+            )
+            logger.error(f"[AGENT] {name} tool exited with code {process.exitcode}, restarting in {backoff:.0f} seconds...")
+            await _wait_for_event(stop_event, backoff)
+
+
+    async def __stop_process(self, name, process):
+        """Asks a worker process to stop, and kills it if it doesn't in time."""
+        if process.is_alive():
+            process.terminate()
+            await asyncio.to_thread(process.join, self.config.SHUTDOWN_TIMEOUT)
+        if process.is_alive():
+            logger.warning(f"[AGENT] {name} tool did not stop in time.")
+            process.kill()
+            await asyncio.to_thread(process.join)
+
+
+def run_worker(name, gateway_path):
+    """Runs a single tool in a worker process, using the model gateway."""
+    from .agent_tools.model.model_gateway import ModelGatewayClient
+
+    agent = Agent(model=ModelGatewayClient(gateway_path), tool_names=[name])
+    if name not in agent.tools:
+        sys.exit(1)
+    asyncio.run(agent.run_async())
+
+
+async def _wait_for_event(event, timeout):
+    """Waits up to `timeout` seconds for `event`, returns whether it is set."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    return event.is_set()
@@ -1,4 +1,22 @@
 class AgentConfig:
     def __init__(self):
         self.TWITTER_ENABLED = True
-        self.DISCORD_ENABLED = True
\ No newline at end of file
+        self.DISCORD_ENABLED = True
+
+        # How tools are run: "threads" runs every tool in its own thread,
+        # "async" runs every tool on a single event loop, "processes" runs
+        # every tool in its own worker process
+        self.RUNTIME = "threads"
+
+        # Number of seconds tools are given to finish their work when the
+        # agent shuts down
+        self.SHUTDOWN_TIMEOUT = 30
+
+        # Path of the Unix socket through which worker processes share the
+        # model, or `None` to use a temporary file
+        self.MODEL_GATEWAY_PATH = None
+
+        # Number of seconds before a failed worker process is restarted, the
+        # delay doubles after every failure in a row up to the maximum
+        self.WORKER_RESTART_BACKOFF = 1
+        self.WORKER_RESTART_BACKOFF_MAX = 60
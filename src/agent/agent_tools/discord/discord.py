@@ -1,11 +1,42 @@
+import asyncio
+import collections
 import discord
 import logging
+import time
 from .discord_config import DiscordConfig
+from .discord_memory import ConversationMemory
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logging.basicConfig(format="%(levelname)s: %(message)s")
 
+# Maximum number of characters in a discord message
+MESSAGE_MAX_LENGTH = 2000
+
+
+class ChannelQueue:
+    """
+    Messages of a channel that are waiting to be responded to.
+
+    Attributes:
+        pending (list): Messages received within the debounce interval, which
+            are responded to together.
+        first_received_at (float): When the oldest pending message arrived.
+        timer (asyncio.TimerHandle): Flushes the pending messages once the
+            channel has been quiet for the debounce interval.
+        batches (collections.deque): Flushed batches of messages waiting for
+            their response, oldest first.
+        worker (asyncio.Task): Responds to the batches one at a time.
+    """
+    __slots__ = ("pending", "first_received_at", "timer", "batches", "worker")
+
+    def __init__(self):
+        self.pending = []
+        self.first_received_at = None
+        self.timer = None
+        self.batches = collections.deque()
+        self.worker = None
+
 class Discord(discord.Client):
     def __init__(
             self,
@@ -15,36 +46,228 @@ class Discord(discord.Client):
         self.token = token
         self.model = model
         self.config = DiscordConfig()
-    
+        self.__client_initialized = False
+        self.__stopping = False
+        self.__replies = set()
+        self.__channels = {}
 
-    def run(self):
-        logger.info("[DISCORD] Starting Discord client...")
+        # Recent messages per channel, used as context for responses
+        self.memory = ConversationMemory(
+            channel_size=self.config.MEMORY_CHANNEL_SIZE,
+            max_channels=self.config.MEMORY_MAX_CHANNELS
+        )
+    
 
+    def __initialize_client(self):
+        """Initializes the underlying discord client (only once)."""
+        if self.__client_initialized:
+            return
         intents = discord.Intents.default()
         intents.message_content = True
 
         super().__init__(intents=intents)
+        self.__client_initialized = True
+
+
+    def run(self):
+        logger.info("[DISCORD] Starting Discord client...")
+        self.__initialize_client()
         super().run(self.token, log_level=logging.WARNING)
 
 
+    async def start(self, token=None, *, reconnect=True):
+        """Connects to discord on the running event loop."""
+        logger.info("[DISCORD] Starting Discord client...")
+        self.__initialize_client()
+        await super().start(token or self.token, reconnect=reconnect)
+
+
+    async def stop(self):
+        """Stops accepting messages, waits for replies in flight and disconnects."""
+        logger.info("[DISCORD] Stopping Discord client...")
+        self.__stopping = True
+        for channel_id in list(self.__channels):
+            self.__flush(channel_id)
+        if self.__replies:
+            await asyncio.wait(self.__replies, timeout=self.config.SHUTDOWN_TIMEOUT)
+        await self.close()
+
+
     async def on_ready(self):
         logging.info(f"[DISCORD] Connected to discord bot {self.user.name} with id {self.user.id}.")
 
 
     async def on_message(self, message):
+        if message.author == self.user or self.__stopping or not self.__is_watched(message):
+            return
+
+        # Remember every message in watched channels, including the ones that
+        # aren't responded to, as context for later responses
+        self.memory.add(
+            message.channel.id,
+            message.author.display_name,
+            message.content,
+            message.created_at.timestamp()
+        )
+        if not self.__is_addressed(message):
+            return
         logging.info(f"[DISCORD] Message received: {message.content}")
-        if message.author == self.user:
+
+        # Wait for the channel to be quiet for the debounce interval, so that
+        # a burst of messages is responded to once
+        loop = asyncio.get_running_loop()
+        channel = self.__channels.setdefault(message.channel.id, ChannelQueue())
+        if not channel.pending:
+            channel.first_received_at = loop.time()
+        channel.pending.append(message)
+        if channel.timer is not None:
+            channel.timer.cancel()
+
+        # Busy channels are flushed anyway once the oldest message has waited
+        # for `DEBOUNCE_MAX_WAIT` seconds
+        delay = min(
+            self.config.DEBOUNCE_INTERVAL,
+            channel.first_received_at + self.config.DEBOUNCE_MAX_WAIT - loop.time()
+        )
+        if delay > 0:
+            channel.timer = loop.call_later(delay, self.__flush, message.channel.id)
+        else:
+            self.__flush(message.channel.id)
+
+
+    def __is_watched(self, message):
+        """Checks the message against the channel filter."""
+        return not self.config.CHANNELS or (
+            message.channel.id in self.config.CHANNELS
+            or getattr(message.channel, "name", None) in self.config.CHANNELS
+        )
+
+
+    def __is_addressed(self, message):
+        """Checks the message against the mention filter."""
+        if self.config.MENTIONS_ONLY and not isinstance(message.channel, discord.DMChannel):
+            return self.user.mentioned_in(message)
+        return True
+
+
+    def __flush(self, channel_id):
+        """Queues the channel's pending messages to be responded to together."""
+        channel = self.__channels[channel_id]
+        if channel.timer is not None:
+            channel.timer.cancel()
+            channel.timer = None
+        if not channel.pending:
             return
 
-        prompt = f"{self.config.RESPONSE_PROMPT} {message.content}"
+        # Drop the oldest batch rather than falling further behind
+        if len(channel.batches) >= self.config.MAX_QUEUED_REPLIES:
+            dropped = channel.batches.popleft()
+            logging.warning(f"[DISCORD] Too many queued replies, skipping {len(dropped)} messages.")
+        channel.batches.append(channel.pending)
+        channel.pending = []
+
+        if channel.worker is None:
+            channel.worker = asyncio.get_running_loop().create_task(self.__respond_to_channel(channel_id))
+
+            # Keep track of replies in flight so that they can finish on shutdown
+            self.__replies.add(channel.worker)
+
+
+    async def __respond_to_channel(self, channel_id):
+        """Responds to the channel's queued batches of messages, in order."""
+        channel = self.__channels[channel_id]
         try:
-            # Generate response using model
-            response = self.model.query(prompt)
-            logging.info(f"[DISCORD] Response: {response}")
-        
-            # Post response
-            logging.info("[DISCORD] Sending response...")
-            await message.channel.send(response)
+            while channel.batches:
+                await self.__respond(channel.batches.popleft())
+        finally:
+            self.__replies.discard(channel.worker)
+            channel.worker = None
+            if not channel.pending and not channel.batches:
+                del self.__channels[channel_id]
+
+
+    async def __respond(self, messages):
+        """Responds to a batch of messages from one channel with one reply."""
+        message = messages[-1]
+        if len(messages) == 1:
+            prompt = f"{self.config.RESPONSE_PROMPT} {message.content}"
+        else:
+            conversation = "\n".join(f"{m.author.display_name}: {m.content}" for m in messages)
+            prompt = f"{self.config.COALESCED_RESPONSE_PROMPT}\n{conversation}"
+
+        # Add the channel's earlier messages as context
+        context = self.memory.context(
+            message.channel.id,
+            max_tokens=self.config.CONTEXT_MAX_TOKENS,
+            before=messages[0].created_at.timestamp()
+        )
+        if context:
+            prompt = f"{self.config.CONTEXT_PROMPT}\n{context}\n\n{prompt}"
+
+        try:
+            if self.config.STREAM_REPLIES:
+                response = await self.__stream_response(message, prompt)
+            else:
+                # Generate response using model without blocking the event loop
+                response = await self.model.aquery(prompt)
+                logging.info(f"[DISCORD] Response: {response}")
+            
+                # Post response
+                logging.info("[DISCORD] Sending response...")
+                for part in self.__split_message(response):
+                    await message.channel.send(part)
+
+            self.memory.add(message.channel.id, self.user.display_name, response, time.time())
 
         except Exception as e:
-            logging.exception(f"[DISCORD] Error responding to message {message.id}. {e}")
\ No newline at end of file
+            logging.exception(f"[DISCORD] Error responding to message {message.id}. {e}")
+
+
+    async def __stream_response(self, message, prompt):
+        """
+        Posts the response as soon as the model starts generating it and edits
+        it as the rest arrives, at most once every `EDIT_INTERVAL` seconds.
+        Parts beyond discord's message length are posted as follow-up messages.
+        """
+        sent = []
+        response = ""
+        last_update = 0
+
+        async def update():
+            parts = self.__split_message(response)
+            for i, part in enumerate(parts):
+                if i == len(sent):
+                    sent.append((await message.channel.send(part), part))
+                elif sent[i][1] != part:
+                    sent[i] = (await sent[i][0].edit(content=part), part)
+
+        async for chunk in self.model.astream(prompt):
+            response += chunk
+            if response.strip() and time.monotonic() - last_update >= self.config.EDIT_INTERVAL:
+                await update()
+                last_update = time.monotonic()
+
+        logging.info(f"[DISCORD] Response: {response}")
+        await update()
+        return response
+
+
+    @staticmethod
+    def __split_message(text):
+        """
+        Splits the whole text into parts that fit into discord messages,
+        preferably at line breaks or spaces. Parts are recomputed on every
+        call, so earlier parts may change as the text grows.
+        """
+        parts = []
+        while len(text) > MESSAGE_MAX_LENGTH:
+            split_at = text.rfind("\n", 0, MESSAGE_MAX_LENGTH)
+            if split_at <= 0:
+                split_at = text.rfind(" ", 0, MESSAGE_MAX_LENGTH)
+            if split_at <= 0:
+                split_at = MESSAGE_MAX_LENGTH
+            parts.append(text[:split_at])
+            text = text[split_at:].lstrip()
+        if text.strip():
+            parts.append(text)
+        return parts
@@ -3,3 +3,53 @@ class DiscordConfig:
         # Prompt that is provided to model, along with discord message, to
         # generate a response
         self.RESPONSE_PROMPT = "Respond to this discord message."
+
+        # Prompt that is provided to model, along with several discord messages
+        # that were received at once, to generate a single response
+        self.COALESCED_RESPONSE_PROMPT = "Respond to these discord messages."
+
+        # Prompt that introduces the channel's earlier messages, which are
+        # provided to the model as context
+        self.CONTEXT_PROMPT = "Earlier messages in this channel, for context:"
+
+        # Maximum number of tokens of earlier messages provided as context, or
+        # 0 to respond without context
+        self.CONTEXT_MAX_TOKENS = 1000
+
+        # Number of recent messages remembered per channel, and number of
+        # channels remembered (the channels that have been quiet the longest
+        # are forgotten first)
+        self.MEMORY_CHANNEL_SIZE = 50
+        self.MEMORY_MAX_CHANNELS = 100
+
+        # Channels (ids or names) in which the bot responds, or an empty list
+        # to respond in every channel it can read
+        self.CHANNELS = []
+
+        # Whether the bot only responds to messages that mention it (direct
+        # messages are always responded to)
+        self.MENTIONS_ONLY = False
+
+        # Number of seconds the bot waits for a channel to be quiet before
+        # responding, so that a burst of messages gets a single response
+        self.DEBOUNCE_INTERVAL = 2.0
+
+        # Maximum number of seconds a message waits in a busy channel before
+        # it is responded to
+        self.DEBOUNCE_MAX_WAIT = 10.0
+
+        # Maximum number of responses queued per channel, the oldest messages
+        # are skipped once a channel falls further behind
+        self.MAX_QUEUED_REPLIES = 3
+
+        # Number of seconds the client waits for replies that are being
+        # generated or sent when the agent shuts down
+        self.SHUTDOWN_TIMEOUT = 30
+
+        # Whether responses are posted while they are being generated and
+        # edited as the rest arrives, rather than posted once complete
+        self.STREAM_REPLIES = True
+
+        # Minimum number of seconds between edits of a streamed response
+        # (discord rate limits message edits)
+        self.EDIT_INTERVAL = 1.0
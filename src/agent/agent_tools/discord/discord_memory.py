@@ -0,0 +1,93 @@
+import collections
+from ..model.model_tokens import estimate_tokens
+
+
+class MessageRecord:
+    """
+    The parts of a discord message that are kept as conversation context.
+
+    Attributes:
+        author (str): Display name of the author.
+        content (str): Text of the message.
+        created_at (float): When the message was sent, as a UNIX timestamp.
+        tokens (int): Estimated number of tokens of the formatted record.
+    """
+    __slots__ = ("author", "content", "created_at", "tokens")
+
+    def __init__(self, author, content, created_at):
+        self.author = author
+        self.content = content
+        self.created_at = created_at
+        self.tokens = estimate_tokens(str(self))
+
+    def __str__(self):
+        return f"{self.author}: {self.content}"
+
+    def __repr__(self):
+        return f"MessageRecord(author={self.author!r}, created_at={self.created_at!r})"
+
+
+class ConversationMemory:
+    """
+    Recent messages of each channel, kept in memory so that responses can be
+    given context without fetching the channel's history.
+
+    Every channel keeps its last `channel_size` messages. Once more than
+    `max_channels` channels are remembered, the channels that have been idle
+    the longest are forgotten, so memory use is bounded by
+    `max_channels * channel_size` messages.
+
+    Attributes:
+        channel_size (int): Number of messages kept per channel.
+        max_channels (int): Number of channels kept.
+
+    Methods:
+        add(channel_id, author, content, created_at): Remembers a message.
+
+        context(channel_id, max_tokens, before): Returns the channel's most
+            recent messages that fit into a token budget.
+    """
+
+
+    def __init__(self, channel_size, max_channels):
+        self.channel_size = channel_size
+        self.max_channels = max_channels
+
+        self.__channels = collections.OrderedDict()
+
+
+    def add(self, channel_id, author, content, created_at):
+        """Remembers a message, forgetting the channel's oldest if it is full."""
+        record = MessageRecord(author, content, created_at)
+        messages = self.__channels.get(channel_id)
+        if messages is None:
+            messages = self.__channels[channel_id] = collections.deque(maxlen=self.channel_size)
+        else:
+            self.__channels.move_to_end(channel_id)
+        messages.append(record)
+
+        while len(self.__channels) > self.max_channels:
+            self.__channels.popitem(last=False)
+
+
+    def context(self, channel_id, max_tokens, before=None):
+        """
+        Returns the channel's most recent messages (sent before `before`, if
+        given) that fit into `max_tokens` tokens, oldest first, one per line.
+        """
+        messages = self.__channels.get(channel_id, ())
+
+        lines = []
+        tokens = 0
+        for record in reversed(messages):
+            if before is not None and record.created_at >= before:
+                continue
+            if tokens + record.tokens > max_tokens:
+                break
+            tokens += record.tokens
+            lines.append(str(record))
+        return "\n".join(reversed(lines))
+
+
+    def __len__(self):
+        return sum(len(messages) for messages in self.__channels.values())
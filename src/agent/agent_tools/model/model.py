@@ -1,7 +1,29 @@
-import openai
+import asyncio
+import concurrent.futures
+import contextlib
+import httpx
+import logging
+import math
+import os
+import tenacity
+import threading
+import time
+import weakref
 from datetime import datetime
-from langchain_core.prompts import PromptTemplate
+from .model_batch import BATCH_ITEM_OVERHEAD, build_batch_prompt, parse_batch_response
+from .model_budget import CHARS_PER_TOKEN, OutputBudget, trim_to_length, trim_to_sentence
+from .model_cache import ModelCache
 from .model_config import ModelConfig
+from .model_router import RETRYABLE_ERRORS, Endpoint, ModelRouter, NoEndpointAvailable
+
+logger = logging.getLogger(__name__)
+
+
+class RequestAbandoned(Exception):
+    """
+    Raised to callers waiting for an identical request whose caller was
+    cancelled before it finished, so that they can send the request themselves.
+    """
 
 
 class Model:
@@ -14,10 +36,25 @@ class Model:
             system prompt.
         client (openai.OpenAI): An instance of the OpenAI client configured
             with the provided API key and base URL.
+        cache (ModelCache): Cache of previous responses, or `None` if caching
+            is disabled or the model is not deterministic.
 
     Methods:
-        query(query, contexts): Queries the model and returns the full response
-            as a string.
+        query(query, max_chars, max_tokens): Queries the model and returns
+            the full response as a string, optionally limited to a number of
+            characters or tokens.
+
+        aquery(query, max_chars, max_tokens): Asynchronous version of `query`
+            that doesn't block the event loop it is awaited from.
+
+        astream(query, max_chars, max_tokens): Queries the model
+            asynchronously and yields the response in chunks as they arrive.
+
+        query_batch(instructions, items, max_chars): Generates a response
+            for each of several items with a single request.
+
+        aquery_batch(instructions, items, max_chars): Asynchronous version of
+            `query_batch`.
     """
 
 
@@ -42,58 +79,585 @@ class Model:
         self.max_tokens = self.config.MAX_TOKENS
         self.date_context = datetime.now().strftime("%Y-%m-%d")
 
-        # Set up model API
-        self.client = openai.OpenAI(
-            base_url=self.config.BASE_URL,
-            api_key=self.api_key,
+        # Set up model API. Requests go to the configured endpoint, and to
+        # the fallback endpoints while it is failing
+        endpoints = [
+            Endpoint(
+                name=self.config.BASE_URL,
+                base_url=self.config.BASE_URL,
+                model=self.model,
+                api_key=self.api_key,
+                limits=self.__http_limits(),
+                timeout=self.config.TIMEOUT
+            )
+        ]
+        for fallback in self.config.FALLBACK_ENDPOINTS:
+            endpoints.append(Endpoint(
+                name=fallback["base_url"],
+                base_url=fallback["base_url"],
+                model=fallback.get("model", self.model),
+                api_key=os.getenv(fallback["api_key_env"]) if fallback.get("api_key_env") else self.api_key,
+                limits=self.__http_limits(),
+                timeout=self.config.TIMEOUT
+            ))
+        self.router = ModelRouter(
+            endpoints,
+            failure_threshold=self.config.CIRCUIT_BREAKER_THRESHOLD,
+            cooldown=self.config.CIRCUIT_BREAKER_COOLDOWN
         )
+        self.client = endpoints[0].client
+
+        # Semaphores are created lazily because an asyncio semaphore can only
+        # be used from the event loop it was created in
+        self.__semaphores = weakref.WeakKeyDictionary()
+
+        # Set up response cache. Requests that are in flight are tracked with
+        # thread-safe futures so that identical requests from any thread or
+        # event loop wait for the same call.
+        self.cache = None
+        if self.config.CACHE_ENABLED and self.temperature == 0:
+            self.cache = ModelCache(
+                max_size=self.config.CACHE_SIZE,
+                ttl=self.config.CACHE_TTL,
+                path=self.config.CACHE_PATH
+            )
+        self.__in_flight = {}
+        self.__in_flight_lock = threading.Lock()
 
         # Set up system prompt
         if self.config.SYSTEM_PROMPT == "default":
-            system_prompt_search = PromptTemplate(
-                input_variables=["date_today"],
-                template="You are a helpful assistant that can answer questions and provide information."
-                )
-            self.system_prompt = system_prompt_search.format(date_today=self.date_context)
+            self.system_prompt = "You are a helpful assistant that can answer questions and provide information."
         else:
             self.system_prompt = self.config.SYSTEM_PROMPT
 
 
-    def __query_async(self, query):
-        """Sends query to model and yields the response in chunks."""
-        if self.model in ["o1-preview", "o1-mini"]:
-            messages = [
+    def __http_limits(self):
+        """Returns the connection pool limits shared by sync and async clients."""
+        return httpx.Limits(
+            max_connections=self.config.MAX_CONNECTIONS,
+            max_keepalive_connections=self.config.MAX_KEEPALIVE_CONNECTIONS
+        )
+
+
+    def __get_semaphore(self):
+        """Returns the concurrency semaphore for the running event loop."""
+        loop = asyncio.get_running_loop()
+        semaphore = self.__semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self.__semaphores[loop] = asyncio.Semaphore(self.config.MAX_CONCURRENCY)
+        return semaphore
+
+
+    def __retry_options(self):
+        """Returns the retry policy for requests that fail before the first token."""
+        return dict(
+            stop=tenacity.stop_after_attempt(self.config.RETRY_ATTEMPTS),
+            wait=tenacity.wait_exponential_jitter(
+                initial=self.config.RETRY_BACKOFF,
+                max=self.config.RETRY_BACKOFF_MAX
+            ),
+            retry=tenacity.retry_if_exception_type(RETRYABLE_ERRORS + (NoEndpointAvailable,)),
+            reraise=True
+        )
+
+
+    def __build_messages(self, query, model):
+        """Builds the chat messages that are sent to the model."""
+        if model in ["o1-preview", "o1-mini"]:
+            return [
                 {"role": "user",
                  "content": f"System Instruction: {self.system_prompt} \n Instruction:{query}"}
             ]
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": query}
+        ]
+
+
+    def __open_stream(self, endpoint, query, max_tokens):
+        """
+        Sends query to an endpoint and waits for the first chunk. Returns the
+        stream and the chunks read so far.
+        """
+        started_at = time.monotonic()
+        try:
+            stream = endpoint.client.chat.completions.create(
+                model=endpoint.model,
+                messages=self.__build_messages(query, endpoint.model),
+                stream=True,
+                temperature=self.temperature,
+                max_tokens=max_tokens
+            )
+            try:
+                first = self.__read_first(iter(stream))
+            except BaseException:
+                stream.close()
+                raise
+        except RETRYABLE_ERRORS as e:
+            self.router.record_failure(endpoint, e)
+            raise
+        self.router.record_success(endpoint, time.monotonic() - started_at)
+        return stream, first
+
+
+    @staticmethod
+    def __read_first(chunks):
+        """Reads chunks until the first one with content (or the last one)."""
+        first = []
+        for chunk in chunks:
+            if chunk.choices:
+                first.append((chunk.choices[0].delta.content or "", chunk.choices[0].finish_reason))
+                if first[-1][0] or first[-1][1]:
+                    break
+        return first
+
+
+    def __query_async(self, query, max_tokens, served=None):
+        """
+        Sends query to model and yields the response in chunks, along with
+        the reason the response finished (in the last chunk).
+
+        Requests that fail before the first chunk are retried with jittered
+        backoff, on the next available endpoint. The model of the endpoint
+        that serves the request is appended to `served`, if given.
+        """
+        tried = []
+        for attempt in tenacity.Retrying(**self.__retry_options()):
+            with attempt:
+                endpoint = self.router.select(exclude=tried)
+                tried.append(endpoint)
+                stream, first = self.__open_stream(endpoint, query, max_tokens)
+        if served is not None:
+            served.append(endpoint.model)
+
+        # Closing the stream (also when the caller stops early) closes the
+        # connection, which stops the generation
+        with stream:
+            yield from first
+            chunks = iter(stream)
+            try:
+                for chunk in chunks:
+                    if chunk.choices:
+                        yield chunk.choices[0].delta.content or "", chunk.choices[0].finish_reason
+            except RETRYABLE_ERRORS as e:
+                self.router.record_failure(endpoint, e)
+                raise
+
+
+    def __cache_key(self, query, max_chars, max_tokens, mode):
+        """
+        Returns the cache key identifying a request for `query`. Streamed and
+        complete responses are trimmed differently once truncated, so `mode`
+        ("stream" or "query") keeps them apart.
+
+        Keys always name the primary model, so only responses served by it
+        are cached (see `__is_cacheable`).
+        """
+        return ModelCache.make_key(self.model, self.system_prompt, query, max_chars, max_tokens, mode)
+
+
+    def __join_in_flight(self, key):
+        """
+        Returns the future of the in-flight request for `key` and whether the
+        caller is its owner (i.e. has to query the model and resolve it).
+        """
+        with self.__in_flight_lock:
+            future = self.__in_flight.get(key)
+            if future is not None:
+                self.cache.coalesced += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self.__in_flight[key] = future
+            return future, True
+
+
+    def __is_cacheable(self, response, served):
+        """
+        Returns whether a response can be cached: it isn't empty and was
+        served by the primary model rather than a fallback endpoint's model.
+        """
+        return bool(response) and served == [self.model]
+
+
+    def __leave_in_flight(self, key, future, response=None, error=None, cacheable=False):
+        """
+        Resolves the in-flight request for `key` and stops tracking it.
+
+        If the owner was interrupted (e.g. its task was cancelled) rather than
+        the request failing, waiters are told to send the request themselves
+        instead of being interrupted too. The response is only cached if it
+        is `cacheable`.
+        """
+        with self.__in_flight_lock:
+            self.__in_flight.pop(key, None)
+        if error is not None and not isinstance(error, Exception):
+            future.set_exception(RequestAbandoned())
+        elif error is not None:
+            future.set_exception(error)
         else:
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": query}
-            ]
+            if cacheable:
+                self.cache.set(key, response)
+            future.set_result(response)
 
-        stream = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            stream=True,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens
-        )
 
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+    def __query(self, query, max_chars, max_tokens, served=None):
+        """Queries the model and returns the complete response."""
+        budget = OutputBudget(max_chars)
+        chunks = []
+        with contextlib.closing(self.__query_async(query, max_tokens, served)) as stream:
+            for chunk, finish_reason in stream:
+                chunks.append(budget.feed(chunk, finish_reason))
+                if budget.exhausted:
+                    break
+        chunks.append(budget.flush())
+        response = "".join(chunks)
+        if budget.truncated:
+            response = trim_to_sentence(response)
+        return response
 
 
-    def query(self, query):
+    def query(self, query, max_chars=None, max_tokens=None):
         """
         Sends query to model and returns the complete response as a string.
 
         This method calls the `__query_async` method, concatenates all of the 
         chunks that it yields, and returns the full response as a string.
+        Responses are served from the cache when possible, and identical
+        requests that are already in flight are waited for instead of being
+        sent again.
+
+        If `max_chars` or `max_tokens` is given the response is limited
+        accordingly: generation is stopped as soon as the budget is reached
+        and the response is trimmed to its last complete sentence (or word).
         """
+        max_tokens = OutputBudget.max_tokens(max_chars, max_tokens, self.max_tokens)
+        if self.cache is None:
+            return self.__query(query, max_chars, max_tokens)
+
+        key = self.__cache_key(query, max_chars, max_tokens, "query")
+        while True:
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+
+            future, owner = self.__join_in_flight(key)
+            if owner:
+                break
+            try:
+                return future.result()
+            except RequestAbandoned:
+                continue
+
+        served = []
+        try:
+            response = self.__query(query, max_chars, max_tokens, served)
+        except BaseException as e:
+            self.__leave_in_flight(key, future, error=e)
+            raise
+        self.__leave_in_flight(key, future, response=response, cacheable=self.__is_cacheable(response, served))
+        return response
+
+
+    async def __aopen_stream(self, endpoint, query, max_tokens):
+        """
+        Sends query to an endpoint asynchronously and waits for the first
+        chunk. Returns the endpoint, the stream and the chunks read so far.
+        """
+        started_at = time.monotonic()
+        try:
+            stream = await endpoint.async_client().chat.completions.create(
+                model=endpoint.model,
+                messages=self.__build_messages(query, endpoint.model),
+                stream=True,
+                temperature=self.temperature,
+                max_tokens=max_tokens
+            )
+            try:
+                first = []
+                async for chunk in stream:
+                    if chunk.choices:
+                        first.append((chunk.choices[0].delta.content or "", chunk.choices[0].finish_reason))
+                        if first[-1][0] or first[-1][1]:
+                            break
+            except BaseException:
+                await stream.close()
+                raise
+        except RETRYABLE_ERRORS as e:
+            self.router.record_failure(endpoint, e)
+            raise
+        self.router.record_success(endpoint, time.monotonic() - started_at)
+        return endpoint, stream, first
+
+
+    async def __aopen_hedged(self, query, max_tokens, tried):
+        """
+        Opens a stream on the preferred endpoint. If hedging is enabled and
+        the first chunk takes longer than the endpoint's 95th percentile, a
+        second request is sent (to the next endpoint if there is one) and the
+        first to respond is used.
+        """
+        endpoint = self.router.select(exclude=tried)
+        tried.append(endpoint)
+        requests = {asyncio.ensure_future(self.__aopen_stream(endpoint, query, max_tokens))}
+
+        delay = endpoint.p95() if len(endpoint.latencies) >= self.config.HEDGE_MIN_SAMPLES else None
+        if self.config.HEDGE_REQUESTS and delay is not None:
+            done, _ = await asyncio.wait(requests, timeout=delay)
+            if not done:
+                hedge = self.router.select(exclude=tried)
+                tried.append(hedge)
+                logger.info(f"[MODEL] No response from {endpoint.name} after {delay:.2f}s, hedging with {hedge.name}.")
+                requests.add(asyncio.ensure_future(self.__aopen_stream(hedge, query, max_tokens)))
+
+        try:
+            error = None
+            while requests:
+                done, requests = await asyncio.wait(requests, return_when=asyncio.FIRST_COMPLETED)
+                for request in done:
+                    if request.exception() is None:
+                        return request.result()
+                    error = request.exception()
+            raise error
+        finally:
+            # Cancel the slower request, or close its stream if it already
+            # responded. Only the requests' own errors are ignored, so that
+            # cancelling the caller during cleanup still cancels it
+            for request in requests:
+                request.cancel()
+            if requests:
+                for result in await asyncio.gather(*requests, return_exceptions=True):
+                    if isinstance(result, tuple):
+                        with contextlib.suppress(Exception):
+                            await result[1].close()
+
+
+    async def __astream(self, query, max_tokens, served=None):
+        """
+        Sends query to model asynchronously and yields the response in chunks,
+        along with the reason the response finished (in the last chunk).
+
+        Requests that fail before the first chunk are retried with jittered
+        backoff, on the next available endpoint. The model of the endpoint
+        that serves the request is appended to `served`, if given.
+        """
+        async with self.__get_semaphore():
+            tried = []
+            async for attempt in tenacity.AsyncRetrying(**self.__retry_options()):
+                with attempt:
+                    endpoint, stream, first = await self.__aopen_hedged(query, max_tokens, tried)
+            if served is not None:
+                served.append(endpoint.model)
+
+            async with stream:
+                for item in first:
+                    yield item
+                try:
+                    async for chunk in stream:
+                        if chunk.choices:
+                            yield chunk.choices[0].delta.content or "", chunk.choices[0].finish_reason
+                except RETRYABLE_ERRORS as e:
+                    self.router.record_failure(endpoint, e)
+                    raise
+
+
+    async def __abudgeted(self, query, max_chars, max_tokens, served=None):
+        """Yields the response in chunks, stopping once the budget is reached."""
+        budget = OutputBudget(max_chars)
+        stream = self.__astream(query, max_tokens, served)
+        try:
+            async for chunk, finish_reason in stream:
+                chunk = budget.feed(chunk, finish_reason)
+                if chunk:
+                    yield chunk
+                if budget.exhausted:
+                    return
+            chunk = budget.flush()
+            if chunk:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+
+    async def __aquery(self, query, max_chars, max_tokens, served=None):
+        """Queries the model asynchronously and returns the complete response."""
+        budget = OutputBudget(max_chars)
         chunks = []
-        for chunk in self.__query_async(query=query):
+        stream = self.__astream(query, max_tokens, served)
+        try:
+            async for chunk, finish_reason in stream:
+                chunks.append(budget.feed(chunk, finish_reason))
+                if budget.exhausted:
+                    break
+        finally:
+            await stream.aclose()
+        chunks.append(budget.flush())
+        response = "".join(chunks)
+        if budget.truncated:
+            response = trim_to_sentence(response)
+        return response
+
+
+    async def astream(self, query, max_chars=None, max_tokens=None):
+        """
+        Sends query to model without blocking the event loop and yields the
+        response in chunks.
+
+        At most `MAX_CONCURRENCY` streams run at the same time on one event
+        loop, further calls wait for a free slot. A cached response is
+        yielded as a single chunk. If `max_chars` or `max_tokens` is given
+        the stream ends as soon as the budget is reached, on a word boundary.
+        """
+        max_tokens = OutputBudget.max_tokens(max_chars, max_tokens, self.max_tokens)
+        if self.cache is None:
+            async for chunk in self.__abudgeted(query, max_chars, max_tokens):
+                yield chunk
+            return
+
+        key = self.__cache_key(query, max_chars, max_tokens, "stream")
+        response = self.cache.get(key)
+        if response is not None:
+            yield response
+            return
+
+        chunks = []
+        served = []
+        async for chunk in self.__abudgeted(query, max_chars, max_tokens, served):
             chunks.append(chunk)
+            yield chunk
         response = "".join(chunks)
+        if self.__is_cacheable(response, served):
+            self.cache.set(key, response)
+
+
+    async def aquery(self, query, max_chars=None, max_tokens=None):
+        """
+        Sends query to model without blocking the event loop and returns the
+        complete response as a string.
+
+        Uses the cache, request coalescing and output budget in the same way
+        as `query`.
+        """
+        max_tokens = OutputBudget.max_tokens(max_chars, max_tokens, self.max_tokens)
+        if self.cache is None:
+            return await self.__aquery(query, max_chars, max_tokens)
+
+        key = self.__cache_key(query, max_chars, max_tokens, "query")
+        while True:
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+
+            future, owner = self.__join_in_flight(key)
+            if owner:
+                break
+            # Shielded so that cancelling this caller doesn't cancel the
+            # shared future of the other callers
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except RequestAbandoned:
+                continue
+
+        served = []
+        try:
+            response = await self.__aquery(query, max_chars, max_tokens, served)
+        except BaseException as e:
+            self.__leave_in_flight(key, future, error=e)
+            raise
+        self.__leave_in_flight(key, future, response=response, cacheable=self.__is_cacheable(response, served))
         return response
+
+
+    def __batch_max_tokens(self, items, max_chars):
+        """Returns the token limit of a batched request."""
+        if max_chars is None:
+            return None
+        return math.ceil(len(items) * (max_chars + BATCH_ITEM_OVERHEAD) / CHARS_PER_TOKEN)
+
+
+    @staticmethod
+    def __parse_batch(response, items, max_chars):
+        """
+        Returns the trimmed responses in a batched response by item id, and
+        the items it is missing.
+        """
+        responses = parse_batch_response(response, {item["id"] for item in items}) if response else {}
+        missing = [item for item in items if item["id"] not in responses]
+        if missing:
+            logger.info(f"[MODEL] Batched response is missing {len(missing)} of {len(items)} items, querying them separately.")
+        for item_id in responses:
+            responses[item_id] = trim_to_length(responses[item_id], max_chars)
+        return responses, missing
+
+
+    @staticmethod
+    def __single_prompt(instructions, item, item_prompt):
+        """Returns the prompt used to query the model for a single item."""
+        return item_prompt(item) if item_prompt else f"{instructions}\n\n{item['text']}"
+
+
+    def query_batch(self, instructions, items, max_chars=None, item_prompt=None):
+        """
+        Generates a response for each item with a single request, so that
+        shared instructions (e.g. a persona) are only sent once.
+
+        Args:
+            instructions (str): Instructions that apply to every item.
+            items (list): Dictionaries with an "id" and a "text". Any other
+                keys (e.g. the item's language) are passed to the model.
+            max_chars (int): Maximum number of characters per response.
+            item_prompt (callable): Returns the prompt used to query the model
+                for a single item whose response is missing from the batched
+                response. Defaults to the instructions followed by the text.
+
+        Returns a dictionary of responses by item id.
+        """
+        response = None
+        try:
+            if len(items) > 1:
+                response = self.query(
+                    build_batch_prompt(instructions, items, max_chars),
+                    max_tokens=self.__batch_max_tokens(items, max_chars)
+                )
+        except RETRYABLE_ERRORS + (NoEndpointAvailable,):
+            pass
+        responses, missing = self.__parse_batch(response, items, max_chars)
+
+        # Query the model separately for items the batched response missed
+        for item in missing:
+            responses[item["id"]] = self.query(
+                self.__single_prompt(instructions, item, item_prompt),
+                max_chars=max_chars
+            )
+        return responses
+
+
+    async def aquery_batch(self, instructions, items, max_chars=None, item_prompt=None):
+        """
+        Asynchronous version of `query_batch`. Items missing from the batched
+        response are queried concurrently.
+        """
+        response = None
+        try:
+            if len(items) > 1:
+                response = await self.aquery(
+                    build_batch_prompt(instructions, items, max_chars),
+                    max_tokens=self.__batch_max_tokens(items, max_chars)
+                )
+        except RETRYABLE_ERRORS + (NoEndpointAvailable,):
+            pass
+        responses, missing = self.__parse_batch(response, items, max_chars)
+
+        # Query the model separately (and concurrently) for items the batched
+        # response missed
+        singles = await asyncio.gather(*(
+            self.aquery(self.__single_prompt(instructions, item, item_prompt), max_chars=max_chars)
+            for item in missing
+        ))
+        responses.update({item["id"]: response for item, response in zip(missing, singles)})
+        return responses
+
+
+    async def aclose(self):
+        """Closes the async clients that belong to the running event loop."""
+        for endpoint in self.router.endpoints:
+            await endpoint.aclose()
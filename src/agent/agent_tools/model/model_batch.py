@@ -0,0 +1,63 @@
+import json
+
+# Instructions appended to the caller's instructions of a batched request
+BATCH_INSTRUCTIONS = (
+    "Respond to each of the following items separately. Answer with only a "
+    "JSON list containing one object per item, in the same order, with the "
+    "item's \"id\" and your response as \"response\"."
+)
+
+# Number of characters of JSON around each response in a batched response,
+# used to budget the batched request
+BATCH_ITEM_OVERHEAD = 40
+
+
+def build_batch_prompt(instructions, items, max_chars=None):
+    """
+    Returns a prompt that asks for one response per item. Items are
+    dictionaries with an "id" and a "text", any other keys (e.g. the item's
+    language) are passed along.
+    """
+    limit = f" Each response must be at most {max_chars} characters." if max_chars else ""
+    serialized = json.dumps(items, ensure_ascii=False, indent=0)
+    return f"{instructions}\n\n{BATCH_INSTRUCTIONS}{limit}\n\nITEMS:\n{serialized}\n"
+
+
+def is_response_list(parsed):
+    """Returns whether decoded JSON is a list with at least one response."""
+    return isinstance(parsed, list) and any(
+        isinstance(entry, dict) and "id" in entry and "response" in entry
+        for entry in parsed
+    )
+
+
+def parse_batch_response(response, ids):
+    """
+    Returns the responses in a batched response by item id. Responses that
+    are missing, empty or for unknown ids are left out.
+    """
+    # Decode the first JSON list of responses, ignoring any text (or other
+    # JSON) around it
+    decoder = json.JSONDecoder()
+    parsed = None
+    start = response.find("[")
+    while start >= 0 and parsed is None:
+        try:
+            parsed, _ = decoder.raw_decode(response, start)
+        except ValueError:
+            pass
+        if not is_response_list(parsed):
+            parsed = None
+            start = response.find("[", start + 1)
+    if parsed is None:
+        return {}
+
+    responses = {}
+    for entry in parsed:
+        if not isinstance(entry, dict):
+            continue
+        item_id = str(entry.get("id"))
+        text = entry.get("response")
+        if item_id in ids and item_id not in responses and isinstance(text, str) and text.strip():
+            responses[item_id] = text.strip()
+    return responses
@@ -0,0 +1,123 @@
+import math
+import re
+
+# Conservative number of characters per token, used to derive a token limit
+# from a character budget. It leaves headroom so that generation is normally
+# stopped by the character budget, which ends on a word boundary, rather than
+# by the token limit
+CHARS_PER_TOKEN = 3
+
+# Characters that shouldn't be left dangling at the end of a trimmed response
+DANGLING_CHARACTERS = " \t\n,;:-–—(\"'"
+
+SENTENCE_END = re.compile(r"[.!?…](?=\s|$)")
+
+
+class OutputBudget:
+    """
+    Limits a streamed response to a number of characters.
+
+    Chunks are fed in as they arrive. Only text up to the last complete word
+    is released, so that a response cut off by the budget (or by the token
+    limit) never ends in the middle of a word.
+
+    Attributes:
+        max_chars (int): Maximum number of characters, or `None` for no limit.
+        exhausted (bool): Whether the budget has been reached and the rest of
+            the response should not be generated.
+        truncated (bool): Whether the response was cut off, by the budget or
+            by the token limit.
+
+    Methods:
+        feed(chunk, finish_reason): Adds a chunk and returns the text that can
+            be released.
+
+        flush(): Returns the text that has not been released yet once the
+            response is complete.
+    """
+
+
+    def __init__(self, max_chars=None):
+        self.max_chars = max_chars
+        self.exhausted = False
+        self.truncated = False
+        self.__text = ""
+        self.__released = 0
+
+
+    @staticmethod
+    def max_tokens(max_chars, max_tokens, default_max_tokens):
+        """Returns the token limit for a request with the given budgets."""
+        limits = [limit for limit in (max_tokens, default_max_tokens) if limit is not None]
+        if max_chars is not None:
+            limits.append(math.ceil(max_chars / CHARS_PER_TOKEN))
+        return min(limits) if limits else None
+
+
+    def feed(self, chunk, finish_reason=None):
+        """Adds a chunk of the response and returns the text that can be released."""
+        if self.exhausted:
+            return ""
+        self.__text += chunk
+
+        if self.max_chars is not None and len(self.__text) > self.max_chars:
+            self.exhausted = self.truncated = True
+            end = self.__word_boundary(self.max_chars)
+
+            # A single word longer than the budget is cut wherever it has to
+            if end == 0:
+                end = self.max_chars
+        elif finish_reason == "length":
+            self.exhausted = self.truncated = True
+            end = self.__word_boundary(len(self.__text))
+        elif finish_reason is not None:
+            self.exhausted = True
+            end = len(self.__text)
+        else:
+            # Hold back the last word, it may continue in the next chunk
+            end = self.__word_boundary(len(self.__text))
+
+        return self.__release(end)
+
+
+    def flush(self):
+        """Returns the rest of the response once the stream has ended."""
+        if self.exhausted:
+            return ""
+        self.exhausted = True
+        return self.__release(len(self.__text))
+
+
+    def __word_boundary(self, limit):
+        """Returns the end of the last complete word within `limit` characters."""
+        if limit < len(self.__text) and self.__text[limit].isspace():
+            return limit
+        boundary = max(self.__text.rfind(" ", 0, limit + 1), self.__text.rfind("\n", 0, limit + 1))
+        return max(boundary, self.__released)
+
+
+    def __release(self, end):
+        released = self.__text[self.__released:end]
+        self.__released = max(self.__released, end)
+        if self.truncated:
+            released = released.rstrip(DANGLING_CHARACTERS)
+        return released
+
+
+def trim_to_sentence(text):
+    """
+    Trims a truncated response to its last complete sentence, unless that
+    would drop more than half of it.
+    """
+    ends = [match.end() for match in SENTENCE_END.finditer(text)]
+    if ends and ends[-1] >= len(text) / 2:
+        return text[:ends[-1]]
+    return text
+
+
+def trim_to_length(text, max_chars):
+    """Trims a complete response to `max_chars` characters, on a clean boundary."""
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    budget = OutputBudget(max_chars)
+    return trim_to_sentence(budget.feed(text))
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ModelCache:
+    """
+    A cache for deterministic model responses.
+
+    Responses are kept in an in-memory LRU and, if a path is given, in a
+    SQLite database so that they survive restarts. Entries expire after `ttl`
+    seconds in both stores.
+
+    Attributes:
+        max_size (int): Maximum number of responses kept in memory.
+        ttl (float): Number of seconds after which a response expires.
+        path (str): Path of the SQLite database, or `None` to only cache in
+            memory.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups not found in the cache.
+        coalesced (int): Number of requests that waited for an identical
+            request that was already in flight instead of querying the model.
+
+    Methods:
+        make_key(*parts): Returns a cache key for the given request parts.
+
+        get(key): Returns the cached response for `key` or `None`.
+
+        set(key, response): Stores a response in the cache.
+
+        stats(): Returns the cache counters as a dictionary.
+    """
+
+
+    def __init__(self, max_size, ttl, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+        self.__db = None
+        if path:
+            self.__db = sqlite3.connect(path, check_same_thread=False)
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self.__db.execute(
+                "DELETE FROM responses WHERE created_at < ?",
+                (time.time() - self.ttl,)
+            )
+            self.__db.commit()
+
+
+    @staticmethod
+    def make_key(*parts):
+        """Returns a stable hash of the parts that identify a request."""
+        serialized = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+    def get(self, key):
+        """Returns the cached response for `key`, or `None` on a miss."""
+        now = time.time()
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if now - created_at < self.ttl:
+                    self.__entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self.__entries[key]
+
+            if self.__db is not None:
+                row = self.__db.execute(
+                    "SELECT response, created_at FROM responses WHERE key = ?",
+                    (key,)
+                ).fetchone()
+                if row is not None:
+                    response, created_at = row
+                    if now - created_at < self.ttl:
+                        self.__remember(key, response, created_at)
+                        self.hits += 1
+                        return response
+                    self.__db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.__db.commit()
+
+            self.misses += 1
+            return None
+
+
+    def set(self, key, response):
+        """Stores `response` under `key` in memory and on disk."""
+        created_at = time.time()
+        with self.__lock:
+            self.__remember(key, response, created_at)
+            if self.__db is not None:
+                self.__db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, response, created_at)
+                )
+                self.__db.commit()
+
+
+    def __remember(self, key, response, created_at):
+        """Adds an entry to the in-memory LRU, evicting the oldest entries."""
+        self.__entries[key] = (response, created_at)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+
+
+    def stats(self):
+        """Returns the cache counters."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self.__entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+    def close(self):
+        """Closes the on-disk store."""
+        with self.__lock:
+            if self.__db is not None:
+                self.__db.close()
+                self.__db = None
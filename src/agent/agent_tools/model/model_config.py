@@ -13,4 +13,58 @@ class ModelConfig:
         self.MAX_TOKENS = None
        
         # A system message or prompt to guide model behavior
-        self.SYSTEM_PROMPT = "default"
\ No newline at end of file
+        self.SYSTEM_PROMPT = "default"
+
+        # Maximum number of async requests that can be sent to the model at
+        # the same time (per event loop)
+        self.MAX_CONCURRENCY = 8
+
+        # Size of the HTTP connection pool shared by all requests
+        self.MAX_CONNECTIONS = 20
+        self.MAX_KEEPALIVE_CONNECTIONS = 10
+
+        # Timeout in seconds for a single request to the model provider
+        self.TIMEOUT = 60.0
+
+        # Additional OpenAI API compatible endpoints that requests are sent to
+        # while the endpoints before them are failing, most preferred first.
+        # Each endpoint is a dictionary with a "base_url", and optionally the
+        # "model" it serves and the environment variable ("api_key_env")
+        # holding its API key, e.g.
+        # {"base_url": "http://localhost:8000/v1", "model": "dobby", "api_key_env": "LOCAL_MODEL_API_KEY"}
+        self.FALLBACK_ENDPOINTS = []
+
+        # Number of attempts for requests that fail before the first token
+        # (connection errors, rate limits and server errors), and the initial
+        # and maximum number of seconds between attempts (with random jitter)
+        self.RETRY_ATTEMPTS = 3
+        self.RETRY_BACKOFF = 0.5
+        self.RETRY_BACKOFF_MAX = 8.0
+
+        # Number of failed requests in a row after which an endpoint is skipped,
+        # and number of seconds after which it is tried again
+        self.CIRCUIT_BREAKER_THRESHOLD = 3
+        self.CIRCUIT_BREAKER_COOLDOWN = 30
+
+        # If true async requests that are slower to start responding than 95%
+        # of recent requests are sent again (to the next endpoint if there is
+        # one) and the first response is used. Only enabled once an endpoint
+        # has served `HEDGE_MIN_SAMPLES` requests
+        self.HEDGE_REQUESTS = False
+        self.HEDGE_MIN_SAMPLES = 20
+
+        # If true identical requests are answered from a cache and concurrent
+        # identical requests share one call to the model. The cache is only
+        # used while TEMPERATURE is 0, because only then are responses
+        # deterministic
+        self.CACHE_ENABLED = True
+
+        # Maximum number of responses kept in the in-memory cache
+        self.CACHE_SIZE = 1024
+
+        # Number of seconds after which cached responses expire
+        self.CACHE_TTL = 24 * 60 * 60
+
+        # Path of a SQLite database used to keep cached responses between
+        # runs (None to only cache responses in memory)
+        self.CACHE_PATH = None
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+# Maximum size of a request or response line (prompts and responses are
+# small, this only protects the gateway from runaway clients)
+LINE_LIMIT = 4 * 1024 * 1024
+
+
+class ModelGateway:
+    """
+    A local server that shares one model between several processes.
+
+    Requests are received over a Unix socket, one JSON request per connection,
+    and answered by the wrapped model, so that connection pooling, caching,
+    request coalescing and concurrency limits apply across all processes.
+
+    Attributes:
+        model (Model): The model that answers requests.
+        path (str): Path of the Unix socket.
+
+    Methods:
+        start(): Starts accepting connections on the running event loop.
+
+        close(): Stops accepting connections and removes the socket.
+    """
+
+
+    def __init__(self, model, path):
+        self.model = model
+        self.path = path
+        self.__server = None
+
+
+    async def start(self):
+        """Starts accepting connections on the running event loop."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.__server = await asyncio.start_unix_server(
+            self.__handle,
+            path=self.path,
+            limit=LINE_LIMIT
+        )
+        os.chmod(self.path, 0o600)
+        logger.info(f"[MODEL] Model gateway listening on {self.path}.")
+
+
+    async def close(self):
+        """Stops accepting connections and removes the socket."""
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+    async def __handle(self, reader, writer):
+        """Answers a single request, streaming the response if asked to."""
+        try:
+            request = json.loads(await reader.readline())
+            budget = {
+                "max_chars": request.get("max_chars"),
+                "max_tokens": request.get("max_tokens")
+            }
+            if request.get("stream"):
+                async for chunk in self.model.astream(request["query"], **budget):
+                    await self.__send(writer, {"chunk": chunk})
+                await self.__send(writer, {"done": True})
+            else:
+                response = await self.model.aquery(request["query"], **budget)
+                await self.__send(writer, {"response": response})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.exception(f"[MODEL] Error answering gateway request. {e}")
+            try:
+                await self.__send(writer, {"error": str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+
+    @staticmethod
+    async def __send(writer, message):
+        writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        await writer.drain()
+
+
+class ModelGatewayClient:
+    """
+    A model that forwards requests to a `ModelGateway`.
+
+    It can be used wherever a `Model` is used, e.g. by tools that run in a
+    worker process.
+
+    Attributes:
+        path (str): Path of the gateway's Unix socket.
+
+    Methods:
+        query(query, max_chars, max_tokens): Queries the model and returns
+            the full response as a string.
+
+        aquery(query, max_chars, max_tokens): Asynchronous version of `query`.
+
+        astream(query, max_chars, max_tokens): Queries the model
+            asynchronously and yields the response in chunks as they arrive.
+    """
+
+
+    def __init__(self, path):
+        self.path = path
+
+
+    def query(self, query, max_chars=None, max_tokens=None):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self.path)
+            connection.sendall(self.__encode({"query": query, "max_chars": max_chars, "max_tokens": max_tokens}))
+            with connection.makefile("rb") as lines:
+                return self.__decode(lines.readline())["response"]
+
+
+    async def aquery(self, query, max_chars=None, max_tokens=None):
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+        try:
+            writer.write(self.__encode({"query": query, "max_chars": max_chars, "max_tokens": max_tokens}))
+            await writer.drain()
+            return self.__decode(await reader.readline())["response"]
+        finally:
+            writer.close()
+
+
+    async def astream(self, query, max_chars=None, max_tokens=None):
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+        try:
+            writer.write(self.__encode({
+                "query": query,
+                "max_chars": max_chars,
+                "max_tokens": max_tokens,
+                "stream": True
+            }))
+            await writer.drain()
+            while True:
+                message = self.__decode(await reader.readline())
+                if message.get("done"):
+                    return
+                yield message["chunk"]
+        finally:
+            writer.close()
+
+
+    async def aclose(self):
+        pass
+
+
+    @staticmethod
+    def __encode(request):
+        return json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+    @staticmethod
+    def __decode(line):
+        if not line:
+            raise ConnectionError("[MODEL] Model gateway closed the connection.")
+        message = json.loads(line)
+        if "error" in message:
+            raise Exception(f"[MODEL] Model gateway error: {message['error']}")
+        return message
@@ -0,0 +1,196 @@
+import asyncio
+import collections
+import logging
+import math
+import threading
+import time
+import weakref
+import openai
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a request is retried (on another endpoint if there is
+# one) and which count against the endpoint's circuit breaker. Other errors,
+# e.g. invalid requests, are raised immediately
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# Number of recent latencies kept per endpoint
+LATENCY_WINDOW = 100
+
+
+class NoEndpointAvailable(Exception):
+    """Raised when the circuit breakers of all endpoints are open."""
+
+
+class Endpoint:
+    """
+    An OpenAI API compatible endpoint and its health.
+
+    Attributes:
+        name (str): Name used in logs.
+        base_url (str): URL of the endpoint.
+        model (str): Identifier of the model served by the endpoint.
+        client (openai.OpenAI): Client for the endpoint.
+        latencies (collections.deque): Recent times to first token, in
+            seconds.
+        requests (int): Number of requests sent to the endpoint.
+        errors (int): Number of requests that failed.
+        consecutive_errors (int): Number of requests in a row that failed.
+        opened_at (float): When the circuit breaker opened, or `None` while
+            it is closed.
+    """
+
+    __slots__ = (
+        "name", "base_url", "model", "api_key", "client", "latencies",
+        "requests", "errors", "consecutive_errors", "opened_at",
+        "__limits", "__timeout", "__async_clients"
+    )
+
+
+    def __init__(self, name, base_url, model, api_key, limits, timeout):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.opened_at = None
+
+        self.__limits = limits
+        self.__timeout = timeout
+        # Retries are left to the router, which can fail over to another
+        # endpoint instead
+        self.client = openai.OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=0,
+            http_client=openai.DefaultHttpxClient(limits=limits, timeout=timeout)
+        )
+
+        # Async clients are created lazily because an httpx connection pool
+        # can only be used from the event loop it was created in
+        self.__async_clients = weakref.WeakKeyDictionary()
+
+
+    def async_client(self):
+        """Returns the async client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        client = self.__async_clients.get(loop)
+        if client is None:
+            client = openai.AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                max_retries=0,
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=self.__limits,
+                    timeout=self.__timeout
+                )
+            )
+            self.__async_clients[loop] = client
+        return client
+
+
+    async def aclose(self):
+        """Closes the async client that belongs to the running event loop."""
+        client = self.__async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+
+    def p95(self):
+        """Returns the 95th percentile of recent latencies, or `None`."""
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+
+
+class ModelRouter:
+    """
+    Routes requests to a list of endpoints in order of preference.
+
+    Every endpoint has a circuit breaker: after `failure_threshold` failed
+    requests in a row the endpoint is skipped for `cooldown` seconds, after
+    which requests are let through again to probe it.
+
+    Attributes:
+        endpoints (list): The endpoints, most preferred first.
+
+    Methods:
+        select(exclude): Returns the most preferred available endpoint.
+
+        record_success(endpoint, latency): Records a successful request.
+
+        record_failure(endpoint, error): Records a failed request.
+
+        stats(): Returns the health of every endpoint as a dictionary.
+    """
+
+
+    def __init__(self, endpoints, failure_threshold, cooldown):
+        self.endpoints = endpoints
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.__lock = threading.Lock()
+
+
+    def select(self, exclude=()):
+        """
+        Returns the most preferred endpoint whose circuit breaker is closed
+        (or whose cooldown has passed), preferring endpoints not in `exclude`.
+        """
+        now = time.monotonic()
+        with self.__lock:
+            available = [
+                endpoint for endpoint in self.endpoints
+                if endpoint.opened_at is None or now - endpoint.opened_at >= self.cooldown
+            ]
+        if not available:
+            raise NoEndpointAvailable("[MODEL] All model endpoints are failing.")
+        for endpoint in available:
+            if endpoint not in exclude:
+                return endpoint
+        return available[0]
+
+
+    def record_success(self, endpoint, latency):
+        """Records a successful request and its time to first token."""
+        with self.__lock:
+            endpoint.requests += 1
+            endpoint.latencies.append(latency)
+            endpoint.consecutive_errors = 0
+            if endpoint.opened_at is not None:
+                logger.info(f"[MODEL] Endpoint {endpoint.name} recovered.")
+            endpoint.opened_at = None
+
+
+    def record_failure(self, endpoint, error):
+        """Records a failed request, and opens the circuit breaker if needed."""
+        with self.__lock:
+            endpoint.requests += 1
+            endpoint.errors += 1
+            endpoint.consecutive_errors += 1
+            if endpoint.consecutive_errors >= self.failure_threshold:
+                if endpoint.opened_at is None:
+                    logger.warning(f"[MODEL] Endpoint {endpoint.name} is failing, skipping it for {self.cooldown} seconds. {error}")
+                endpoint.opened_at = time.monotonic()
+
+
+    def stats(self):
+        """Returns the requests, errors, latency and state of every endpoint."""
+        with self.__lock:
+            return {
+                endpoint.name: {
+                    "requests": endpoint.requests,
+                    "errors": endpoint.errors,
+                    "p95": endpoint.p95(),
+                    "open": endpoint.opened_at is not None
+                }
+                for endpoint in self.endpoints
+            }
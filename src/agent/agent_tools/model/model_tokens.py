@@ -0,0 +1,19 @@
+import re
+
+# Words, numbers and punctuation each count as roughly one token; long words
+# are split into several tokens by most tokenizers
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens in `text` without loading a tokenizer.
+
+    The estimate is close enough to budget prompts, but it is not exact for
+    any particular model.
+    """
+    return sum(
+        max(1, -(-len(token) // CHARS_PER_TOKEN))
+        for token in TOKEN_PATTERN.findall(text)
+    )
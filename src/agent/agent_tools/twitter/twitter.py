@@ -1,21 +1,63 @@
+import asyncio
+import collections
 import datetime
 import logging
+import queue
+import random
 import schedule
+import threading
 import time
-import tweepy
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
+from ..model.model_tokens import estimate_tokens
+from .twitter_activity import ActivityTracker
 from .twitter_config import TwitterConfig
+from .twitter_conversations import ConversationIndex, TweetCache
+from .twitter_scheduler import RateLimitScheduler, ScheduledClient
+from .twitter_state import TwitterState, tweet_id_timestamp
+from .twitter_stream import TwitterStream
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
 
+# The recent search endpoint only returns tweets from the last 7 days, older
+# since_id watermarks are rejected (a small margin is kept for clock skew)
+SEARCH_WINDOW_SECONDS = 7 * 24 * 60 * 60 - 60 * 60
+
+# Maximum number of tweets returned per page by the recent search endpoint
+SEARCH_PAGE_SIZE = 100
+
+# Maximum number of ids per tweet lookup request
+LOOKUP_BATCH_SIZE = 100
+
+# Fields requested for every tweet, whether searched, looked up or streamed
+TWEET_FIELDS = ["created_at","author_id","conversation_id"]
+TWEET_EXPANSIONS = ["author_id","referenced_tweets.id"]
+
+# Reconnect backoff of the filtered stream: delays grow exponentially from the
+# base to the max, and a connection that stayed up for the stable period
+# resets it
+STREAM_BACKOFF_BASE_SECONDS = 5
+STREAM_BACKOFF_MAX_SECONDS = 320
+STREAM_STABLE_SECONDS = 5 * 60
+
 class Twitter:
     """A class for interfacing with the Twitter API using Tweepy.
 
     Attributes:
         client (tweepy.Client): The authenticated Tweepy client instance for
             interacting with the Twitter API.
+        scheduler (RateLimitScheduler): Queues API requests according to the
+            rate limits reported by the API.
         user_id (str): The ID of the authenticated Twitter user.
+        state (TwitterState): Durable store of the newest tweet seen per
+            search query and of the tweets that have been responded to.
+        conversations (ConversationIndex): Key users' recent conversations,
+            updated incrementally by every run.
+        known_tweets (TweetCache): Tweets seen by previous runs, used to
+            rebuild threads.
+        activity (ActivityTracker): Key users' tweet rates, used to adapt the
+            interval between runs.
     
     Methods:
         get_relevant_conversations(key_users, conversation_ids, start_time):
@@ -52,13 +94,19 @@ class Twitter:
         authentication and retrieves the authenticated user's ID.
         """
         logger.info("[TWITTER] Initializing Twitter client...")
-        self.v2api = tweepy.Client(
+        self.config = TwitterConfig()
+
+        # All requests (search, lookups, posts) are scheduled according to the
+        # rate limits of their endpoint
+        self.scheduler = RateLimitScheduler(max_wait=self.config.RATE_LIMIT_MAX_WAIT)
+        self.v2api = ScheduledClient(
             bearer_token=bearer_token,
             consumer_key=consumer_key,
             consumer_secret=consumer_secret,
             access_token=access_token,
             access_token_secret=access_token_secret,
-            return_type=dict
+            return_type=dict,
+            scheduler=self.scheduler
         )
         
         logger.info("[TWITTER] Starting Twitter client...")
@@ -67,11 +115,30 @@ class Twitter:
         self.user_id = self.user["data"]["id"]
 
         self.model = model
-        self.config = TwitterConfig()
+        self.__bearer_token = bearer_token
 
         # Calculate interval in minutes between runs
         self.interval = 1440.0 / self.config.RUNS_PER_DAY
 
+        # Load incremental state from previous runs
+        self.state = TwitterState(self.config.STATE_PATH)
+        self.__pending_since_ids = {}
+        self.conversations = ConversationIndex()
+        self.known_tweets = TweetCache(self.config.KNOWN_TWEETS_CACHE_SIZE)
+        self.__last_post_time = None
+        self.__stream_tweets = queue.Queue()
+        self.__stream = None
+        self.__search_requests = 0
+        self.__stop_event = threading.Event()
+        self.__async_stop_event = None
+        self.activity = ActivityTracker(
+            half_life=self.config.ACTIVITY_HALF_LIFE,
+            min_interval=self.config.MIN_INTERVAL,
+            max_interval=self.config.MAX_INTERVAL,
+            daily_budget=self.config.DAILY_SEARCH_BUDGET,
+            target_tweets=self.config.TWEETS_PER_RUN_TARGET
+        )
+
         logging.info(f"[TWITTER] Connected to twitter user @{self.username} with id {self.user_id}.")
         
         if not self.config.KEY_USERS:
@@ -81,19 +148,186 @@ class Twitter:
 
 
     def run(self):
-        def job():
+        if self.config.STREAM_MODE:
+            self.__run_stream()
+        self.__run_polling()
+
+
+    async def start(self):
+        """
+        Runs the agent on the running event loop. Runs are scheduled against
+        the loop's clock (so that their duration does not delay the next one)
+        and executed in a worker thread since the Twitter client is blocking.
+        """
+        loop = asyncio.get_running_loop()
+        self.__async_stop_event = asyncio.Event()
+        if self.__stop_event.is_set():
+            return
+
+        if self.config.STREAM_MODE:
+            await asyncio.to_thread(self.__run_stream)
+
+        next_run = loop.time()
+        while not self.__stop_event.is_set():
+            await asyncio.to_thread(self.__run_job)
+
+            # Skip runs that were missed instead of running them back to back
+            next_run += self.interval * 60
+            if next_run < loop.time():
+                next_run = loop.time()
+            try:
+                await asyncio.wait_for(self.__async_stop_event.wait(), timeout=next_run - loop.time())
+            except asyncio.TimeoutError:
+                pass
+
+
+    async def stop(self):
+        """
+        Stops the agent. The current run (if any) stops waiting for rate
+        limits and post slots, and doesn't start any further responses.
+        """
+        logger.info("[TWITTER] Stopping Twitter client...")
+        self.__stop_event.set()
+        self.scheduler.close()
+        if self.__async_stop_event is not None:
+            self.__async_stop_event.set()
+        if self.__stream is not None:
+            self.__stream.disconnect()
+
+
+    def __run_job(self):
+        """Responds to key users, posts and adapts the interval between runs."""
+        try:
             self.respond_to_key_users()
             if self.config.POST_MODE:
                 self.post_tweet()
+        except Exception as e:
+            if self.__stop_event.is_set():
+                logging.info(f"[TWITTER] Run interrupted by shutdown. {e}")
+            else:
+                logging.exception(f"[TWITTER] Error during run. {e}")
+
+        if self.config.ADAPTIVE_POLLING:
+            self.interval = self.activity.next_interval(now=time.time())
+            logging.info(f"[TWITTER] Next run in {self.interval:.0f} minutes.")
+
+
+    def __run_polling(self):
+        """
+        Searches for and responds to key users' tweets at a fixed interval,
+        or at an interval that adapts to key users' activity.
+        """
+        def job():
+            self.__run_job()
+
+            # Replace this job with one at the adapted interval
+            if self.config.ADAPTIVE_POLLING:
+                schedule.every(self.interval).minutes.do(job)
+                return schedule.CancelJob
 
         job()
 
-        # Schedule job to run at calculated interval
-        schedule.every(self.interval).minutes.do(job)
+        # Schedule job to run at calculated interval. In adaptive mode every
+        # run has already scheduled the next one itself
+        if not self.config.ADAPTIVE_POLLING:
+            schedule.every(self.interval).minutes.do(job)
 
-        while True:
+        while not self.__stop_event.is_set():
             schedule.run_pending()
-            time.sleep(60)
+            self.__stop_event.wait(60)
+
+
+    def __run_stream(self):
+        """
+        Responds to key users' tweets as they arrive through the filtered
+        stream. Reconnects with exponential backoff and returns (so that the
+        agent falls back to polling) once the stream has failed
+        `STREAM_MAX_RECONNECTS` times in a row.
+        """
+        stream = self.__stream = TwitterStream(
+            bearer_token=self.__bearer_token,
+            callback=lambda tweet, includes: self.__stream_tweets.put((tweet, includes)),
+            max_retries=self.config.STREAM_MAX_RETRIES
+        )
+        try:
+            stream.sync_rules(self.__build_search_queries())
+        except Exception as e:
+            logging.exception(f"[TWITTER] Could not set up filtered stream, falling back to polling. {e}")
+            return
+
+        worker = threading.Thread(target=self.__respond_to_stream, daemon=True)
+        worker.start()
+
+        failures = 0
+        while failures < self.config.STREAM_MAX_RECONNECTS and not self.__stop_event.is_set():
+            connected_at = time.monotonic()
+            try:
+                stream.filter(tweet_fields=TWEET_FIELDS, expansions=TWEET_EXPANSIONS)
+            except Exception as e:
+                logging.exception(f"[TWITTER] Filtered stream failed. {e}")
+            if self.__stop_event.is_set():
+                break
+
+            if time.monotonic() - connected_at > STREAM_STABLE_SECONDS:
+                failures = 0
+            failures += 1
+            backoff = min(STREAM_BACKOFF_MAX_SECONDS, STREAM_BACKOFF_BASE_SECONDS * 2 ** failures)
+            backoff *= random.uniform(0.5, 1.0)
+            logging.warning(f"[TWITTER] Filtered stream disconnected, reconnecting in {backoff:.0f} seconds...")
+            if self.__stop_event.wait(backoff):
+                break
+
+        if not self.__stop_event.is_set():
+            logging.error(f"[TWITTER] Filtered stream keeps failing, falling back to polling.")
+        self.__stream = None
+        self.__stream_tweets.put(None)
+        worker.join()
+
+
+    def __respond_to_stream(self):
+        """
+        Responds to streamed tweets. Tweets that arrive within
+        `STREAM_BATCH_SECONDS` of each other (e.g. a thread) are handled
+        together.
+        """
+        while True:
+            item = self.__stream_tweets.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.config.STREAM_BATCH_SECONDS
+            while item is not None and deadline > time.monotonic():
+                try:
+                    item = self.__stream_tweets.get(timeout=deadline - time.monotonic())
+                except queue.Empty:
+                    break
+                if item is not None:
+                    batch.append(item)
+
+            try:
+                self.__respond_to_streamed_tweets(batch)
+            except Exception as e:
+                logging.exception(f"[TWITTER] Error responding to streamed tweets. {e}")
+
+            if item is None:
+                return
+
+
+    def __respond_to_streamed_tweets(self, batch):
+        """Indexes a batch of streamed tweets and responds to them."""
+        logging.info(f"[TWITTER] Received {len(batch)} tweets from filtered stream.")
+        authors = {}
+        tweets = []
+        for tweet, includes in batch:
+            authors.update({user["id"]: user["username"] for user in includes.get("users", [])})
+            for included_tweet in includes.get("tweets", []):
+                self.known_tweets.add(included_tweet)
+            self.known_tweets.add(tweet)
+            tweets.append(tweet)
+
+        relevant_conversations = self.__index_tweets([tweets], authors)
+        self.__respond_to_conversations(relevant_conversations)
 
 
     def __build_search_query_users(self, key_users):
@@ -116,6 +350,105 @@ class Twitter:
         return " -is:quote"
 
 
+    def __build_search_query_filters(self):
+        """Returns the part of the search query that follows the users"""
+        query = self.__build_search_query_ignore_retweets()
+        if self.config.KEY_PHRASE:
+            query += self.__build_search_query_key_phrase()
+        if self.config.QUOTE_MODE:
+            query += self.__build_search_query_ignore_quotes()
+        return query
+
+
+    def __build_search_queries(self):
+        """
+        Returns the search queries for tweets from key users.
+
+        Key users are split across as few queries as possible so that no
+        query is longer than `SEARCH_QUERY_MAX_LENGTH`.
+        """
+        filters = self.__build_search_query_filters()
+        max_length = self.config.SEARCH_QUERY_MAX_LENGTH
+
+        queries = []
+        users = []
+        for user in self.config.KEY_USERS:
+            query = self.__build_search_query_users(users + [user]) + filters
+            if users and len(query) > max_length:
+                queries.append(self.__build_search_query_users(users) + filters)
+                users = []
+            users.append(user)
+        if users:
+            queries.append(self.__build_search_query_users(users) + filters)
+        return queries
+
+
+    def __search_tweets(self, query, start_time, authors):
+        """
+        Searches for tweets matching `query` and yields them page by page.
+
+        Follows `next_token` until `SEARCH_MAX_PAGES` pages or
+        `SEARCH_MAX_TWEETS` tweets have been fetched. Users included in each
+        page are merged into `authors`, and the page's tweets and referenced
+        tweets into `known_tweets`, before the page's tweets are yielded.
+
+        Only tweets newer than the query's `since_id` watermark are fetched.
+        If there is no watermark yet (or it is older than the search window of
+        the recent search endpoint) tweets since `start_time` are fetched.
+        """
+        logging.debug(f"[TWITTER] Twitter search query: {query}")
+
+        # Continue from the newest tweet seen by previous runs
+        since_id = self.state.get_since_id(query)
+        if since_id and time.time() - tweet_id_timestamp(since_id) > SEARCH_WINDOW_SECONDS:
+            since_id = None
+        if since_id:
+            start_time = None
+
+        next_token = None
+        tweet_count = 0
+        for page in range(self.config.SEARCH_MAX_PAGES):
+            response = self.v2api.search_recent_tweets(
+                query=query,
+                since_id=since_id,
+                start_time=start_time,
+                max_results=SEARCH_PAGE_SIZE,
+                next_token=next_token,
+                tweet_fields=TWEET_FIELDS,
+                expansions=TWEET_EXPANSIONS
+            )
+            self.__search_requests += 1
+            logging.debug(f"[TWITTER] Twitter search results: {response}")
+
+            meta = response.get("meta", {})
+            if not response.get("data", False):
+                break
+
+            # Results are returned newest first, so the first page holds the
+            # new watermark. It is stored once the run has finished
+            # processing the tweets
+            if page == 0 and meta.get("newest_id"):
+                self.__pending_since_ids[query] = meta["newest_id"]
+
+            includes = response.get("includes", {})
+            authors.update({user["id"]: user["username"] for user in includes.get("users", [])})
+            for tweet in includes.get("tweets", []):
+                self.known_tweets.add(tweet)
+
+            tweets = response["data"][:self.config.SEARCH_MAX_TWEETS - tweet_count]
+            for tweet in tweets:
+                self.known_tweets.add(tweet)
+            tweet_count += len(tweets)
+            yield tweets
+
+            next_token = meta.get("next_token")
+            if not next_token:
+                break
+            if tweet_count >= self.config.SEARCH_MAX_TWEETS or page + 1 >= self.config.SEARCH_MAX_PAGES:
+                logging.warning(f"[TWITTER] Search budget reached after {tweet_count} tweets, remaining results are skipped.")
+                break
+
+
     def __search_for_relevant_conversations(self, start_time=None):
         """
         Gets tweets from key users or from specific conversations.
@@ -123,82 +456,176 @@ class Twitter:
         Returns tweets grouped by conversation_id.
         """
 
-        # Build search query
-        query = self.__build_search_query_users(self.config.KEY_USERS)
-        query += self.__build_search_query_ignore_retweets()
-        if self.config.KEY_PHRASE:
-            query += self.__build_search_query_key_phrase()
-        if self.config.QUOTE_MODE:
-            query += self.__build_search_query_ignore_quotes()
-        logging.debug(f"[TWITTER] Twitter search query: {query}")
+        # Authors lookup dict shared by all pages and queries
+        authors = {}
 
-        # Search for tweets
-        response = self.v2api.search_recent_tweets(
-            query=query,
-            start_time=start_time,
-            tweet_fields=["created_at","author_id","conversation_id", "public_metrics"],
-            expansions=["author_id","referenced_tweets.id"]
+        pages = (
+            page
+            for query in self.__build_search_queries()
+            for page in self.__search_tweets(query, start_time, authors)
         )
-        logging.debug(f"[TWITTER] Twitter search results: {response}")
-
-        if not response.get("data", False):
-            return {}
-
-        # Create authors lookup dict
-        authors = {user["id"]: user["username"] for user in response["includes"]["users"]}
-        logging.debug(f"[TWITTER] Authors look up dictionary: {authors}")
-
-        # Create tweets lookup dict
-        tweets = {tweet["id"]: tweet for tweet in response["data"]}
-        logging.debug(f"[TWITTER] Tweets look up dictionary: {tweets}")
-
-        conversations = {}
-        for tweet in tweets.values():
-            author_id = tweet["author_id"]
-            conversation_id = tweet["conversation_id"]
-
-            # We only want to consider replies that are part of a thread started
-            # by the author
-            referenced_tweets = tweet.get("referenced_tweets", [])
-            if referenced_tweets:
-                # Check that tweet is a reply
-                reply = referenced_tweets[0]["type"] == "replied_to"
-                # Check that tweet is a reply to another tweet in tweets
-                replied_to = tweets.get(referenced_tweets[0]["id"], False)
-                # Check that the tweet is a reply to a tweet by the same author
-                if reply and ((not replied_to) or (not replied_to["author_id"] == author_id)):
-                    continue
 
-            # If there is no entry corresponding to author then intialize
-            # object
-            authors_conversations = conversations.get(author_id, {})
-
-            # If there is no entry corresponding to conversation then intialize
-            # array
-            conversation = authors_conversations.get(conversation_id, [])
-            
-            # Add tweet to conversation
-            conversation.append(
-                {
-                    "id": tweet["id"],
-                    "text": tweet["text"],
-                    "author_id": tweet["author_id"],
-                    "author": authors[tweet["author_id"]],
-                    "created_at": tweet["created_at"],
-                    "conversation_id": tweet["conversation_id"],
-                    "referenced_tweets": referenced_tweets,
-                    "public_metrics": tweet["public_metrics"]
-                }
-            )
+        # Count each key user's new tweets to track their activity
+        tweet_counts = collections.Counter()
+        def count_tweets(pages):
+            for page in pages:
+                tweet_counts.update(tweet["author_id"] for tweet in page)
+                yield page
+
+        self.__search_requests = 0
+        relevant_conversations = self.__index_tweets(count_tweets(pages), authors)
+        self.activity.observe(tweet_counts, self.__search_requests, now=time.time())
+        logging.debug(f"[TWITTER] Key users' activity: {sum(self.activity.rates(time.time()).values()):.2f} tweets per hour.")
+        return relevant_conversations
+
+
+    def __index_tweets(self, pages, authors):
+        """
+        Adds relevant tweets to their conversations and returns the
+        conversations that have been updated, grouped by author.
+
+        `pages` is an iterable of lists of tweets. The tweets (and the tweets
+        they reference) are expected to be in `known_tweets` already.
+        """
+
+        # Replies that are part of a thread, and replies whose parent tweet
+        # hasn't been seen yet
+        replies = []
+        deferred = []
+
+        for page in pages:
+            # Tweets are indexed as soon as their page arrives
+            for tweet in page:
+                relevant = self.__is_relevant(tweet)
+                if relevant is None:
+                    deferred.append(tweet)
+                elif relevant:
+                    self.conversations.add(tweet, authors[tweet["author_id"]])
+                    if self.__parent_id(tweet):
+                        replies.append(tweet)
+
+        # Look up the missing tweets of all threads at once, then reconsider
+        # the replies whose parent wasn't known
+        self.__lookup_missing_ancestors(replies + deferred, authors)
+        for tweet in deferred:
+            if self.__is_relevant(tweet):
+                self.conversations.add(tweet, authors[tweet["author_id"]])
+                replies.append(tweet)
+
+        # Add the earlier tweets of each thread to its conversation
+        for tweet in replies:
+            self.__add_ancestors(tweet, authors)
+
+        # Forget conversations that are too old to be responded to
+        self.conversations.prune(
+            max_age=self.config.CONVERSATION_RETENTION_DAYS * 24 * 60 * 60,
+            now=time.time()
+        )
+        return self.conversations.take_updated()
+
+
+    def __parent_id(self, tweet):
+        """Returns the id of the tweet that `tweet` replies to, or `None`."""
+        referenced = tweet.get("referenced_tweets", [])
+        if referenced and referenced[0]["type"] == "replied_to":
+            return referenced[0]["id"]
+        return None
+
+
+    def __is_relevant(self, tweet):
+        """
+        Returns whether a tweet should be added to its author's conversation,
+        or `None` if that depends on a parent tweet that isn't known yet.
 
-            # Sort tweets in conversation from oldest to newest
-            sorted_conversation = sorted(conversation, key=lambda k: k["created_at"])
+        We only want to consider replies that are part of a thread started by
+        the author.
+        """
+        # Check that tweet is a reply
+        parent_id = self.__parent_id(tweet)
+        if parent_id is None:
+            return True
+
+        # Check that the tweet is a reply to a tweet by the same author. The
+        # parent is either a known tweet or part of the author's conversation
+        # from a previous run
+        replied_to = self.known_tweets.get(parent_id)
+        if replied_to:
+            return replied_to.get("author_id") == tweet["author_id"]
+        conversation = self.conversations.get(tweet["author_id"], tweet["conversation_id"])
+        if conversation is not None and parent_id in conversation:
+            return True
+        return None
+
+
+    def __thread_ancestors(self, tweet):
+        """
+        Walks up the thread of `tweet` through known tweets by the same author.
 
-            # Update conversations dictionary
-            authors_conversations[conversation_id] = sorted_conversation
-            conversations[author_id] = authors_conversations
+        Returns the ancestors found (newest first) and the id of the first
+        ancestor that isn't known, if any.
+        """
+        ancestors = []
+        current = tweet
+        for _ in range(self.config.THREAD_MAX_DEPTH):
+            parent_id = self.__parent_id(current)
+            if parent_id is None:
+                break
+            parent = self.known_tweets.get(parent_id)
+            if parent is None:
+                return ancestors, parent_id
+            if parent.get("author_id") != tweet["author_id"]:
+                break
+            ancestors.append(parent)
+            current = parent
+        return ancestors, None
+
+
+    def __lookup_missing_ancestors(self, tweets, authors):
+        """
+        Looks up the unknown ancestors of the threads of `tweets`, in as few
+        requests as possible.
 
-        return conversations
+        Each round looks up, in batches of up to 100 ids, the first unknown
+        ancestor of every thread. Tweets that can't be looked up (e.g. because
+        they were deleted) are not requested again.
+        """
+        attempted = set()
+        requests = 0
+        found = 0
+        for _ in range(self.config.THREAD_MAX_DEPTH):
+            missing = set()
+            for tweet in tweets:
+                _, missing_id = self.__thread_ancestors(tweet)
+                if missing_id and missing_id not in attempted:
+                    missing.add(missing_id)
+            if not missing:
+                break
+            attempted.update(missing)
+
+            ids = sorted(missing)
+            for i in range(0, len(ids), LOOKUP_BATCH_SIZE):
+                response = self.v2api.get_tweets(
+                    ids=ids[i:i + LOOKUP_BATCH_SIZE],
+                    tweet_fields=TWEET_FIELDS,
+                    expansions=TWEET_EXPANSIONS
+                )
+                requests += 1
+                includes = response.get("includes", {})
+                authors.update({user["id"]: user["username"] for user in includes.get("users", [])})
+                for tweet in response.get("data", []) + includes.get("tweets", []):
+                    self.known_tweets.add(tweet)
+                found += len(response.get("data", []))
+
+        if requests:
+            logging.info(f"[TWITTER] Looked up {found} missing thread tweets in {requests} requests.")
+
+
+    def __add_ancestors(self, tweet, authors):
+        """Adds the known earlier tweets of a thread to its conversation."""
+        ancestors, _ = self.__thread_ancestors(tweet)
+        for ancestor in ancestors:
+            if "created_at" in ancestor and "conversation_id" in ancestor:
+                self.conversations.add(ancestor, authors[tweet["author_id"]])
 
 
     def __get_relevant_conversations(self):
@@ -216,17 +643,65 @@ class Twitter:
         return relevant_conversations
 
 
+    def __commit_since_ids(self):
+        """Stores the watermarks of the searches made during this run."""
+        for query, since_id in self.__pending_since_ids.items():
+            self.state.set_since_id(query, since_id)
+        self.__pending_since_ids.clear()
+
+
+    def __target_tweet_id(self, conversation):
+        """Returns the id of the tweet the agent replies to or quotes."""
+        if self.config.QUOTE_MODE:
+            return conversation[0].id
+        return conversation[-1].id
+
+
+    def __generate_response(self, conversation):
+        """Uses model to generate a response to conversation"""
+        serialized = conversation.to_prompt(self.config.PROMPT_MAX_TOKENS)
+        logging.info(
+            f"[TWITTER] Conversation {conversation.id} serialized to "
+            f"{estimate_tokens(serialized)} tokens ({estimate_tokens(repr(conversation))} as raw tweets)."
+        )
+        prompt = f"{self.config.RESPONSE_PROMPT}\n{serialized}"
+        return self.model.query(prompt, max_chars=self.config.RESPONSE_MAX_LENGTH)
+
+
+    def __wait_for_post_slot(self):
+        """
+        Waits until at least `POST_INTERVAL` seconds have passed since the
+        last post. Returns `False` if the agent is stopped in the meantime.
+        """
+        if self.__last_post_time is not None:
+            wait = self.__last_post_time + self.config.POST_INTERVAL - time.monotonic()
+            if wait > 0 and self.__stop_event.wait(wait):
+                return False
+        if self.__stop_event.is_set():
+            return False
+        self.__last_post_time = time.monotonic()
+        return True
+
+
     def __respond_to_conversation(self, conversation, response):
-        """Uses model to respond to conversation"""
+        """Posts response to conversation"""
 
         logging.debug(pformat(conversation))
 
-        first_tweet_id = conversation[0]["id"]
-        last_tweet_id = conversation[-1]["id"]
-        reply_tweet_id = last_tweet_id if not self.config.QUOTE_MODE else None
-        quote_tweet_id = first_tweet_id if self.config.QUOTE_MODE else None
-
-        self.post_tweet(response, reply_tweet_id, quote_tweet_id)
+        target_tweet_id = self.__target_tweet_id(conversation)
+        reply_tweet_id = target_tweet_id if not self.config.QUOTE_MODE else None
+        quote_tweet_id = target_tweet_id if self.config.QUOTE_MODE else None
+
+        if not self.__wait_for_post_slot():
+            logging.info(f"[TWITTER] Stopping, response to conversation {conversation.id} not posted.")
+            return False
+        success, _ = self.post_tweet(response, reply_tweet_id, quote_tweet_id)
+        if success:
+            self.state.mark_replied(
+                [tweet.id for tweet in conversation],
+                conversation.id
+            )
+        return success
 
 
     def respond_to_key_users(self):
@@ -234,6 +709,13 @@ class Twitter:
 
         logging.info(f"[TWITTER] Responding to key users...")
         relevant_conversations = self.__get_relevant_conversations()
+        self.__respond_to_conversations(relevant_conversations)
+        self.__commit_since_ids()
+        self.__log_quotas()
+
+
+    def __respond_to_conversations(self, relevant_conversations):
+        """Responds to conversations, grouped by author"""
         response_count = 0
 
         # Terminate if there are no relevant conversations
@@ -241,33 +723,61 @@ class Twitter:
             logging.info(f"[TWITTER] No conversations to respond to.")
             return
         
+        # Skip conversations that have already been responded to
+        conversations = []
         for user_conversations in relevant_conversations.values():
             for conversation in user_conversations.values():
-                # Terminate if bot has already responded to max no of tweets
-                if response_count >= self.config.RESPONSES_PER_RUN:
-                    logging.info(f"[TWITTER] Responded to max responses.")
-                    break
-
-                conversation_id = conversation[0]["conversation_id"]
-                logging.info(f"[TWITTER] Responding to conversation {conversation_id}...")
-
-                prompt = f"{self.config.RESPONSE_PROMPT} {conversation}"
+                if self.state.is_replied(self.__target_tweet_id(conversation)):
+                    logging.info(f"[TWITTER] Already responded to conversation {conversation.id}.")
+                    continue
+                conversations.append(conversation)
+        conversations = iter(conversations)
+
+        # Responses are generated by a pool of workers and posted one at a
+        # time, in order. No more responses are generated than are still
+        # needed to reach RESPONSES_PER_RUN successful posts, so a failed
+        # response makes room for the next conversation
+        in_flight = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.config.RESPONSE_WORKERS) as executor:
+            def generate_responses():
+                while (len(in_flight) < self.config.RESPONSE_WORKERS
+                       and response_count + len(in_flight) < self.config.RESPONSES_PER_RUN
+                       and not self.__stop_event.is_set()):
+                    conversation = next(conversations, None)
+                    if conversation is None:
+                        return
+                    logging.info(f"[TWITTER] Responding to conversation {conversation.id}...")
+                    in_flight.append((conversation, executor.submit(self.__generate_response, conversation)))
+
+            generate_responses()
+            while in_flight:
+                conversation, future = in_flight.popleft()
                 try:
-                    # Generate response using model and remove quotation marks
-                    response = self.model.query(prompt)
-                    logging.info(f"[TWITTER] Response: {response}")
-                
+                    response = future.result()
+                    logging.info(f"[TWITTER] Response to conversation {conversation.id}: {response}")
+
                     # Post response
                     logging.info(f"[TWITTER] Posting response...")
-                    self.__respond_to_conversation(conversation, response)
-                    response_count += 1
+                    if self.__respond_to_conversation(conversation, response):
+                        response_count += 1
 
                 except Exception as e:
-                    logging.exception(f"[TWITTER] Error responding to conversation {conversation_id}. {e}")
-                
+                    logging.exception(f"[TWITTER] Error responding to conversation {conversation.id}. {e}")
+
+                generate_responses()
+
+        if response_count >= self.config.RESPONSES_PER_RUN:
+            logging.info(f"[TWITTER] Responded to max responses.")
+
         logging.info(f"[TWITTER] Successfully responded to relevant conversations.")
 
 
+    def __log_quotas(self):
+        """Logs the remaining API quota of every endpoint used so far."""
+        for endpoint, quota in self.scheduler.quotas().items():
+            logging.info(f"[TWITTER] Remaining {endpoint} quota: {quota['remaining']}/{quota['limit']}.")
+
+
     def post_tweet(self, post_text, in_reply_to_tweet_id=None, quote_tweet_id=None):
         """Posts a new tweet or a reply to the specified tweet."""
         try:
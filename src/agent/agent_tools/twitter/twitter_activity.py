@@ -0,0 +1,82 @@
+import math
+
+
+class ActivityTracker:
+    """
+    Tracks how often key users tweet and derives the interval between runs
+    from it.
+
+    Each user's tweet rate is an exponentially decayed estimate: every tweet
+    adds to it, and it halves every `half_life` minutes without tweets. The
+    interval between runs is chosen so that about `target_tweets` new tweets
+    are found per run, within `min_interval` and `max_interval`, and never
+    shorter than what `daily_budget` search requests allow.
+
+    Attributes:
+        half_life (float): Half-life of the rate estimates in minutes.
+        min_interval (float): Shortest interval between runs in minutes.
+        max_interval (float): Longest interval between runs in minutes.
+        daily_budget (int): Maximum number of search requests per day.
+        target_tweets (float): Number of new tweets to find per run.
+
+    Methods:
+        observe(tweet_counts, search_requests, now): Records the tweets found
+            by a run and the number of search requests it made.
+
+        rates(now): Returns each user's estimated tweet rate.
+
+        next_interval(now): Returns the number of minutes until the next run.
+    """
+
+
+    def __init__(self, half_life, min_interval, max_interval, daily_budget, target_tweets):
+        self.half_life = half_life
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.daily_budget = daily_budget
+        self.target_tweets = target_tweets
+
+        # Time constant (in minutes) of the exponential decay
+        self.__tau = half_life / math.log(2)
+        # Rate (tweets per minute) and time of the last update per user
+        self.__rates = {}
+        # Moving average of the number of search requests per run
+        self.__requests_per_run = None
+
+
+    def __decayed_rate(self, user, now):
+        """Returns a user's rate decayed up to `now` (seconds since the epoch)."""
+        rate, updated_at = self.__rates.get(user, (0.0, now))
+        return rate * math.exp(-(now - updated_at) / 60.0 / self.__tau)
+
+
+    def observe(self, tweet_counts, search_requests, now):
+        """
+        Records the number of new tweets per user found by a run, and the
+        number of search requests the run made.
+        """
+        for user in set(self.__rates) | set(tweet_counts):
+            rate = self.__decayed_rate(user, now) + tweet_counts.get(user, 0) / self.__tau
+            self.__rates[user] = (rate, now)
+
+        if self.__requests_per_run is None:
+            self.__requests_per_run = float(search_requests)
+        else:
+            self.__requests_per_run = 0.8 * self.__requests_per_run + 0.2 * search_requests
+
+
+    def rates(self, now):
+        """Returns each user's estimated number of tweets per hour."""
+        return {user: self.__decayed_rate(user, now) * 60.0 for user in self.__rates}
+
+
+    def next_interval(self, now):
+        """Returns the number of minutes until the next run should start."""
+        rate = sum(self.__decayed_rate(user, now) for user in self.__rates)
+        interval = self.target_tweets / rate if rate > 0 else self.max_interval
+        interval = min(max(interval, self.min_interval), self.max_interval)
+
+        # Runs may not be more frequent than the daily search budget allows
+        if self.__requests_per_run and self.daily_budget:
+            interval = max(interval, 1440.0 * self.__requests_per_run / self.daily_budget)
+        return interval
@@ -21,8 +21,93 @@ class TwitterConfig:
         # generate a response
         self.RESPONSE_PROMPT = "Respond to this twitter conversation using less than 280 characters. Do not use hashtags."
 
+        # Maximum number of characters of a response, generation is stopped
+        # once it is reached and the response is trimmed to a whole sentence
+        # or word
+        self.RESPONSE_MAX_LENGTH = 280
+
+        # Maximum number of tokens of the conversation provided to the model,
+        # older tweets of long threads are left out first
+        self.PROMPT_MAX_TOKENS = 1000
+
         # Agent will post this number of respones per run
         self.RESPONSES_PER_RUN = 1
        
         # Agent will run this number of times per day
-        self.RUNS_PER_DAY = 12
\ No newline at end of file
+        self.RUNS_PER_DAY = 12
+
+        # Path of the SQLite database in which the agent keeps the newest tweet
+        # it has seen per search query and the tweets it has already responded
+        # to, so that it never responds twice (even after a restart)
+        self.STATE_PATH = "twitter_state.db"
+
+        # Maximum length of a search query (512 characters for most API access
+        # levels). If the key users don't fit into one query they are split
+        # across several queries
+        self.SEARCH_QUERY_MAX_LENGTH = 512
+
+        # Maximum number of result pages (of up to 100 tweets each) and of
+        # tweets that are fetched per search query every run
+        self.SEARCH_MAX_PAGES = 10
+        self.SEARCH_MAX_TWEETS = 1000
+
+        # Number of days for which the agent remembers a key user's
+        # conversation, so that new tweets in it are responded to with the
+        # whole thread as context
+        self.CONVERSATION_RETENTION_DAYS = 7
+
+        # Number of tweets the agent remembers between runs, so that threads
+        # can be rebuilt without looking the same tweets up again
+        self.KNOWN_TWEETS_CACHE_SIZE = 10000
+
+        # Maximum number of earlier tweets in a key user's thread that are
+        # added to a conversation (missing ones are looked up in bulk)
+        self.THREAD_MAX_DEPTH = 10
+
+        # Number of responses that are generated by the model at the same time
+        # (responses are always posted one at a time)
+        self.RESPONSE_WORKERS = 4
+
+        # Minimum number of seconds between two posts
+        self.POST_INTERVAL = 10
+
+        # Maximum number of seconds a request to the twitter API waits for its
+        # rate limit to reset before it fails
+        self.RATE_LIMIT_MAX_WAIT = 15 * 60
+
+        # If true the agent receives key users' tweets through the filtered
+        # stream as soon as they are posted, instead of searching for them
+        # every run. The stream needs API access to filtered stream
+        self.STREAM_MODE = False
+
+        # Number of times the stream client retries a dropped connection, and
+        # number of times the agent reconnects to a failing stream before it
+        # falls back to searching for tweets every run
+        self.STREAM_MAX_RETRIES = 3
+        self.STREAM_MAX_RECONNECTS = 5
+
+        # Number of seconds the agent waits for more streamed tweets (e.g. the
+        # rest of a thread) before it responds
+        self.STREAM_BATCH_SECONDS = 5
+
+        # If true the interval between runs adapts to key users' activity:
+        # the agent runs more often while key users are tweeting and less
+        # often while they are quiet (RUNS_PER_DAY then only sets the interval
+        # before the first run)
+        self.ADAPTIVE_POLLING = False
+
+        # Shortest and longest interval between runs in minutes (adaptive
+        # polling only)
+        self.MIN_INTERVAL = 10
+        self.MAX_INTERVAL = 360
+
+        # Maximum number of search requests per day (adaptive polling only)
+        self.DAILY_SEARCH_BUDGET = 300
+
+        # Number of minutes after which a key user's estimated activity halves
+        # if they don't tweet (adaptive polling only)
+        self.ACTIVITY_HALF_LIFE = 120
+
+        # Number of new tweets the agent aims to find per run (adaptive
+        # polling only)
+        self.TWEETS_PER_RUN_TARGET = 1
\ No newline at end of file
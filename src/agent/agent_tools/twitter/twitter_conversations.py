@@ -0,0 +1,237 @@
+from collections import OrderedDict
+from ..model.model_tokens import estimate_tokens
+from .twitter_state import tweet_id_timestamp
+
+
+class TweetRecord:
+    """A compact record of a tweet that is part of a conversation."""
+
+    __slots__ = ("id", "text", "author_id", "author", "created_at", "conversation_id")
+
+
+    def __init__(self, id, text, author_id, author, created_at, conversation_id):
+        self.id = id
+        self.text = text
+        self.author_id = author_id
+        self.author = author
+        self.created_at = created_at
+        self.conversation_id = conversation_id
+
+
+    def to_dict(self):
+        """Returns the record as a dictionary."""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+    def to_line(self):
+        """Returns the author, time (to the minute) and text on one line."""
+        created_at = self.created_at[:16].replace("T", " ")
+        text = " ".join(self.text.split())
+        return f"@{self.author} {created_at}: {text}"
+
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class Conversation:
+    """
+    The tweets of one author in one conversation, ordered from oldest to
+    newest.
+
+    Tweets are appended as they arrive. The conversation is only sorted when
+    a tweet arrives out of order, and then only once, the next time it is
+    read.
+    """
+
+    __slots__ = ("id", "author_id", "__tweets", "__tweet_ids", "__sorted")
+
+
+    def __init__(self, id, author_id):
+        self.id = id
+        self.author_id = author_id
+        self.__tweets = []
+        self.__tweet_ids = set()
+        self.__sorted = True
+
+
+    def add(self, record):
+        """Adds a tweet record, returns `False` if it was already present."""
+        if record.id in self.__tweet_ids:
+            return False
+        if self.__tweets and record.created_at < self.__tweets[-1].created_at:
+            self.__sorted = False
+        self.__tweets.append(record)
+        self.__tweet_ids.add(record.id)
+        return True
+
+
+    @property
+    def tweets(self):
+        """Returns the tweets ordered from oldest to newest."""
+        if not self.__sorted:
+            self.__tweets.sort(key=lambda record: record.created_at)
+            self.__sorted = True
+        return self.__tweets
+
+
+    def __contains__(self, tweet_id):
+        return tweet_id in self.__tweet_ids
+
+
+    def __getitem__(self, index):
+        return self.tweets[index]
+
+
+    def __iter__(self):
+        return iter(self.tweets)
+
+
+    def __len__(self):
+        return len(self.__tweets)
+
+
+    def to_prompt(self, max_tokens):
+        """
+        Returns the conversation as one line per tweet, keeping the newest
+        tweets that fit into `max_tokens` tokens. The newest tweet is always
+        kept, and omitted tweets are marked with a leading "...".
+        """
+        lines = []
+        tokens = 0
+        for record in reversed(self.tweets):
+            line = record.to_line()
+            line_tokens = estimate_tokens(line)
+            if lines and tokens + line_tokens > max_tokens:
+                lines.append("...")
+                break
+            tokens += line_tokens
+            lines.append(line)
+        return "\n".join(reversed(lines))
+
+
+    def __repr__(self):
+        return repr(self.tweets)
+
+
+class ConversationIndex:
+    """
+    An index of key users' conversations, grouped by author.
+
+    The index is kept between runs and updated incrementally: each run adds
+    the tweets it has found, and `take_updated` returns only the
+    conversations that received new tweets since it was last called. Old
+    conversations are dropped with `prune`.
+
+    Methods:
+        add(tweet, author): Adds a tweet (as returned by the API) to the
+            index.
+
+        take_updated(): Returns the conversations updated since the last call,
+            grouped by author.
+
+        prune(max_age): Removes conversations without tweets newer than
+            `max_age` seconds.
+    """
+
+
+    def __init__(self):
+        self.__by_author = {}
+        self.__updated = {}
+
+
+    def add(self, tweet, author):
+        """Adds `tweet` to its author's conversation."""
+        record = TweetRecord(
+            id=tweet["id"],
+            text=tweet["text"],
+            author_id=tweet["author_id"],
+            author=author,
+            created_at=tweet["created_at"],
+            conversation_id=tweet["conversation_id"]
+        )
+
+        authors_conversations = self.__by_author.setdefault(record.author_id, {})
+        conversation = authors_conversations.get(record.conversation_id)
+        if conversation is None:
+            conversation = Conversation(record.conversation_id, record.author_id)
+            authors_conversations[record.conversation_id] = conversation
+
+        if conversation.add(record):
+            self.__updated[(record.author_id, record.conversation_id)] = conversation
+        return record
+
+
+    def get(self, author_id, conversation_id):
+        """Returns a conversation or `None`."""
+        return self.__by_author.get(author_id, {}).get(conversation_id)
+
+
+    def take_updated(self):
+        """
+        Returns the conversations that received new tweets since the last
+        call, as a dictionary of conversations by conversation id by author id.
+        """
+        updated = {}
+        for (author_id, conversation_id), conversation in self.__updated.items():
+            updated.setdefault(author_id, {})[conversation_id] = conversation
+        self.__updated = {}
+        return updated
+
+
+    def prune(self, max_age, now):
+        """Removes conversations whose newest tweet is older than `max_age` seconds."""
+        for author_id in list(self.__by_author):
+            authors_conversations = self.__by_author[author_id]
+            for conversation_id in list(authors_conversations):
+                conversation = authors_conversations[conversation_id]
+                if now - tweet_id_timestamp(conversation[-1].id) > max_age:
+                    del authors_conversations[conversation_id]
+                    self.__updated.pop((author_id, conversation_id), None)
+            if not authors_conversations:
+                del self.__by_author[author_id]
+
+
+    def __len__(self):
+        return sum(len(conversations) for conversations in self.__by_author.values())
+
+
+class TweetCache:
+    """
+    A bounded LRU of tweets the agent has seen (found by searches, included
+    as referenced tweets or looked up), kept between runs so that threads
+    can be rebuilt without fetching the same tweets again.
+
+    Only the fields needed to rebuild threads are kept.
+    """
+
+    FIELDS = ("id", "text", "author_id", "conversation_id", "created_at", "referenced_tweets")
+
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.__tweets = OrderedDict()
+
+
+    def add(self, tweet):
+        """Adds a tweet (as returned by the API) to the cache."""
+        self.__tweets[tweet["id"]] = {field: tweet[field] for field in self.FIELDS if field in tweet}
+        self.__tweets.move_to_end(tweet["id"])
+        while len(self.__tweets) > self.max_size:
+            self.__tweets.popitem(last=False)
+
+
+    def get(self, tweet_id):
+        """Returns a cached tweet or `None`."""
+        tweet = self.__tweets.get(tweet_id)
+        if tweet is not None:
+            self.__tweets.move_to_end(tweet_id)
+        return tweet
+
+
+    def __contains__(self, tweet_id):
+        return tweet_id in self.__tweets
+
+
+    def __len__(self):
+        return len(self.__tweets)
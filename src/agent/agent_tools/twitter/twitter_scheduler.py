@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+import tweepy
+
+logger = logging.getLogger(__name__)
+
+# Header prefixes of the rate limits reported by the API. Besides the
+# 15 minute window of every endpoint, posting is limited per 24 hours per
+# user and per app
+RATE_LIMIT_HEADERS = ("x-rate-limit", "x-user-limit-24hour", "x-app-limit-24hour")
+
+# Number of times a request that was rate limited anyway (HTTP 429) is queued
+# and sent again before it fails. A 429 that persists although the quota has
+# reset is caused by a limit the headers don't report (e.g. a usage cap)
+RATE_LIMITED_MAX_RETRIES = 3
+
+
+def endpoint_name(method, route):
+    """Returns the name of the rate limited endpoint a request is sent to."""
+    if route.startswith("/2/tweets/search/recent"):
+        return "search"
+    if route == "/2/tweets" and method == "POST":
+        return "create_tweet"
+    if route == "/2/users/me":
+        return "get_me"
+    if route.startswith("/2/tweets") and method == "GET":
+        return "lookup"
+    return f"{method} {route}"
+
+
+class RateLimit:
+    """The quota of one endpoint, as last reported by the API."""
+
+    __slots__ = ("limit", "remaining", "reset")
+
+
+    def __init__(self, limit=None, remaining=None, reset=None):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+
+class RateLimitScheduler:
+    """
+    A per-endpoint quota scheduler for the Twitter API.
+
+    Learns each endpoint's limit, remaining calls and reset time from the
+    `x-rate-limit-*` (and 24 hour `x-*-limit-24hour-*`) response headers.
+    Calls to an endpoint whose quota is used up wait until the quota resets
+    instead of failing, so requests are sent as fast as the limits allow.
+
+    Attributes:
+        max_wait (float): Maximum number of seconds a call waits for its
+            quota to reset, calls that would wait longer raise an exception.
+
+    Methods:
+        acquire(endpoint, max_wait): Waits until a call to `endpoint` is
+            allowed and reserves it.
+
+        update(endpoint, headers): Updates the quota of `endpoint` from
+            response headers.
+
+        quotas(): Returns the known quota of every endpoint.
+
+        close(): Wakes up waiting calls and makes all further calls fail.
+    """
+
+
+    def __init__(self, max_wait):
+        self.max_wait = max_wait
+        self.__limits = {}
+        self.__condition = threading.Condition()
+        self.__closed = False
+
+
+    def acquire(self, endpoint, max_wait=None):
+        """
+        Waits until a call to `endpoint` is allowed and reserves it. Raises an
+        exception if the quota resets in more than `max_wait` seconds
+        (defaults to `self.max_wait`) or once the scheduler is closed.
+        """
+        if max_wait is None:
+            max_wait = self.max_wait
+        with self.__condition:
+            while True:
+                if self.__closed:
+                    raise Exception(f"[TWITTER] Request to {endpoint} cancelled, the client is stopping.")
+
+                rate_limit = self.__limits.get(endpoint)
+                if rate_limit is None or rate_limit.remaining is None or rate_limit.remaining > 0:
+                    if rate_limit is not None and rate_limit.remaining is not None:
+                        rate_limit.remaining -= 1
+                    return
+
+                wait = rate_limit.reset - time.time()
+                if wait <= 0:
+                    # The window has reset, assume the full limit is available
+                    # until the next response says otherwise
+                    rate_limit.remaining = rate_limit.limit
+                    continue
+                if wait > max_wait:
+                    raise Exception(f"[TWITTER] Rate limit of {endpoint} only resets in {wait:.0f} seconds.")
+
+                logger.warning(f"[TWITTER] Rate limit of {endpoint} reached, waiting {wait:.0f} seconds...")
+                self.__condition.wait(timeout=wait + 1)
+
+
+    def update(self, endpoint, headers, exhausted=False):
+        """
+        Updates the quota of `endpoint` from response headers. If `exhausted`
+        is true the quota is used up even if the headers don't say so.
+        """
+        limits = []
+        for prefix in RATE_LIMIT_HEADERS:
+            try:
+                limits.append(RateLimit(
+                    limit=int(headers[f"{prefix}-limit"]),
+                    remaining=int(headers[f"{prefix}-remaining"]),
+                    reset=int(headers[f"{prefix}-reset"])
+                ))
+            except (KeyError, ValueError):
+                continue
+
+        if not limits:
+            if not exhausted:
+                return
+            # Without headers, back off for a 15 minute window
+            limits = [RateLimit(limit=None, remaining=0, reset=time.time() + 15 * 60)]
+
+        # The most restrictive limit decides when the next call can be made
+        rate_limit = min(limits, key=lambda limit: (limit.remaining, -limit.reset))
+        if exhausted:
+            rate_limit.remaining = 0
+
+        with self.__condition:
+            self.__limits[endpoint] = rate_limit
+            self.__condition.notify_all()
+
+
+    def close(self):
+        """Wakes up waiting calls and makes all further calls fail."""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+
+    def quotas(self):
+        """Returns the known quota (limit, remaining, reset) of every endpoint."""
+        with self.__condition:
+            return {
+                endpoint: {
+                    "limit": rate_limit.limit,
+                    "remaining": rate_limit.remaining,
+                    "reset": rate_limit.reset
+                }
+                for endpoint, rate_limit in self.__limits.items()
+            }
+
+
+class ScheduledClient(tweepy.Client):
+    """
+    A Tweepy client that sends every request through a `RateLimitScheduler`.
+
+    Requests that are rate limited anyway (HTTP 429) are queued until the
+    quota resets and then sent again, up to `RATE_LIMITED_MAX_RETRIES` times
+    and for at most the scheduler's `max_wait` seconds in total.
+    """
+
+
+    def __init__(self, *args, scheduler, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+
+
+    def request(self, method, route, params=None, json=None, user_auth=False):
+        endpoint = endpoint_name(method, route)
+        started_at = time.monotonic()
+        retries = 0
+        while True:
+            # Waits for the quota are bounded in total, not per retry
+            self.scheduler.acquire(endpoint, max_wait=self.scheduler.max_wait - (time.monotonic() - started_at))
+            try:
+                response = super().request(method, route, params=params, json=json, user_auth=user_auth)
+            except tweepy.TooManyRequests as e:
+                self.scheduler.update(endpoint, e.response.headers, exhausted=True)
+                if retries >= RATE_LIMITED_MAX_RETRIES:
+                    raise
+                retries += 1
+                logger.warning(f"[TWITTER] Request to {endpoint} was rate limited, queueing it.")
+                continue
+            self.scheduler.update(endpoint, response.headers)
+            return response
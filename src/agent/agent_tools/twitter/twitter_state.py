@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+import time
+
+
+# Twitter's snowflake IDs encode their creation time in milliseconds since
+# this epoch
+TWITTER_EPOCH_MS = 1288834974657
+
+
+def tweet_id_timestamp(tweet_id):
+    """Returns the creation time (seconds since the unix epoch) of a tweet id."""
+    return ((int(tweet_id) >> 22) + TWITTER_EPOCH_MS) / 1000.0
+
+
+class TwitterState:
+    """
+    A durable store for the incremental state of the Twitter tool.
+
+    Keeps a `since_id` watermark per search query (the newest tweet that has
+    been seen for the query) and the ids of tweets that have already been
+    responded to, so that runs only fetch new tweets and never respond to the
+    same tweet twice, including across restarts.
+
+    Attributes:
+        path (str): Path of the SQLite database.
+
+    Methods:
+        get_since_id(query): Returns the watermark for a search query.
+
+        set_since_id(query, since_id): Moves the watermark for a search query
+            forward.
+
+        is_replied(tweet_id): Returns whether a tweet has been responded to.
+
+        mark_replied(tweet_ids, conversation_id): Records that tweets have
+            been responded to.
+    """
+
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS watermarks (
+                query TEXT PRIMARY KEY,
+                since_id TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS replied (
+                tweet_id TEXT PRIMARY KEY,
+                conversation_id TEXT,
+                replied_at REAL NOT NULL
+            );
+            """
+        )
+        self.__db.commit()
+
+
+    def get_since_id(self, query):
+        """Returns the newest tweet id seen for `query`, or `None`."""
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT since_id FROM watermarks WHERE query = ?", (query,)
+            ).fetchone()
+        return row[0] if row else None
+
+
+    def set_since_id(self, query, since_id):
+        """Stores `since_id` for `query` unless a newer watermark is stored."""
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT since_id FROM watermarks WHERE query = ?", (query,)
+            ).fetchone()
+            if row and int(row[0]) >= int(since_id):
+                return
+            self.__db.execute(
+                "INSERT OR REPLACE INTO watermarks (query, since_id, updated_at) VALUES (?, ?, ?)",
+                (query, str(since_id), time.time())
+            )
+            self.__db.commit()
+
+
+    def is_replied(self, tweet_id):
+        """Returns whether the agent has already responded to `tweet_id`."""
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT 1 FROM replied WHERE tweet_id = ?", (str(tweet_id),)
+            ).fetchone()
+        return row is not None
+
+
+    def mark_replied(self, tweet_ids, conversation_id=None):
+        """Records that the agent has responded to `tweet_ids`."""
+        now = time.time()
+        with self.__lock:
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO replied (tweet_id, conversation_id, replied_at) VALUES (?, ?, ?)",
+                [(str(tweet_id), conversation_id, now) for tweet_id in tweet_ids]
+            )
+            self.__db.commit()
+
+
+    def close(self):
+        """Closes the database."""
+        with self.__lock:
+            self.__db.close()
@@ -0,0 +1,68 @@
+import json
+import logging
+import tweepy
+
+logger = logging.getLogger(__name__)
+
+# Tag of the filtered stream rules that are managed by the agent, rules with
+# other tags are left untouched
+STREAM_RULE_TAG = "sentius-agent"
+
+
+class TwitterStream(tweepy.StreamingClient):
+    """
+    A filtered stream that passes every matching tweet to a callback.
+
+    Attributes:
+        callback (callable): Called with each matching tweet and the users
+            and tweets included with it, as dictionaries.
+
+    Methods:
+        sync_rules(queries): Makes the agent's stream rules match `queries`.
+    """
+
+
+    def __init__(self, bearer_token, callback, **kwargs):
+        super().__init__(bearer_token, **kwargs)
+        self.callback = callback
+
+
+    def sync_rules(self, queries):
+        """Adds rules for new queries and deletes rules for old ones."""
+        rules = self.get_rules().data or []
+        agent_rules = [rule for rule in rules if rule.tag == STREAM_RULE_TAG]
+
+        stale_rule_ids = [rule.id for rule in agent_rules if rule.value not in queries]
+        if stale_rule_ids:
+            self.delete_rules(stale_rule_ids)
+
+        existing_values = {rule.value for rule in agent_rules}
+        new_rules = [
+            tweepy.StreamRule(value=query, tag=STREAM_RULE_TAG)
+            for query in queries if query not in existing_values
+        ]
+        if new_rules:
+            response = self.add_rules(new_rules)
+            if response.errors:
+                raise Exception(f"[TWITTER] Could not add stream rules: {response.errors}")
+        logger.info(f"[TWITTER] Stream rules: {queries}")
+
+
+    def on_data(self, raw_data):
+        data = json.loads(raw_data)
+        if "data" in data:
+            self.callback(data["data"], data.get("includes", {}))
+        if "errors" in data:
+            logger.warning(f"[TWITTER] Stream errors: {data['errors']}")
+
+
+    def on_connect(self):
+        logger.info("[TWITTER] Connected to filtered stream.")
+
+
+    def on_connection_error(self):
+        logger.warning("[TWITTER] Filtered stream connection error.")
+
+
+    def on_request_error(self, status_code):
+        logger.warning(f"[TWITTER] Filtered stream request failed with status {status_code}.")
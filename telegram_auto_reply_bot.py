@@ -1,6 +1,7 @@
-import os, re, sys, urllib.parse, random, asyncio, time
+import os, re, sys, urllib.parse, random, asyncio, time, contextlib, html, hashlib
+from collections import OrderedDict
 from dotenv import load_dotenv
-from langdetect import detect
+from langdetect import detect, DetectorFactory
 from telegram import Update
 from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTypes
 from playwright.async_api import async_playwright, Error as PlaywrightError
@@ -21,6 +22,17 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 AUTO_POST = os.getenv("AUTO_POST", "true").lower() == "true"
 HEADLESS = os.getenv("HEADLESS", "false").lower() == "true"
 PROFILE_DIR = os.getenv("TWITTER_PROFILE_DIR", "./tw_profile")
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "3"))
+BROWSER_HEALTH_INTERVAL = float(os.getenv("BROWSER_HEALTH_INTERVAL", "60"))
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", str(BROWSER_POOL_SIZE)))
+GENERATE_CONCURRENCY = int(os.getenv("GENERATE_CONCURRENCY", "4"))
+GENERATE_BATCH_SIZE = int(os.getenv("GENERATE_BATCH_SIZE", "5"))
+GENERATE_BATCH_WINDOW = float(os.getenv("GENERATE_BATCH_WINDOW", "0.5"))
+POST_INTERVAL = float(os.getenv("POST_INTERVAL", "5"))
+WAIT_MODE = os.getenv("WAIT_MODE", "ready").lower()
+STEP_TIMEOUT_MS = int(os.getenv("STEP_TIMEOUT_MS", "15000"))
+LEAN_MODE = os.getenv("LEAN_MODE", "true").lower() == "true"
+REPLY_MAX_CHARS = 220
 
 TWEET_URL_RE = re.compile(r"(https?://(?:www\.)?(?:x|twitter)\.com/\w+/status/(\d+))")
 
@@ -59,146 +71,732 @@ async def safe_launch(pw, retries=3, delay=2):
                 raise
 
 
-# --- Tweet metnini çek (Persistent login + retry) ---
-async def fetch_tweet_text(tweet_id: str):
+# --- Hafif sayfa yükleme: medya, font ve izleme isteklerini engelle ---
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+BLOCKED_URL_PARTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "ads-twitter.com",
+    "ads-api.twitter.com",
+    "analytics.twitter.com",
+    "/jot/",
+)
+
+
+async def block_heavy_resources(route):
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+# --- Paylaşılan tarayıcı servisi (tek Chromium + sayfa havuzu) ---
+class BrowserService:
+    """Bot açıkken çalışan tek Chromium ve giriş yapılmış oturumu paylaşan sayfa havuzu."""
+
+    def __init__(self, pool_size=BROWSER_POOL_SIZE, health_interval=BROWSER_HEALTH_INTERVAL):
+        self.pool_size = pool_size
+        self.health_interval = health_interval
+        self._pw = None
+        self._ctx = None
+        self._pages = asyncio.Queue()
+        self._healthy = False
+        self._lock = asyncio.Lock()
+        self._health_task = None
+
+    async def start(self):
+        async with self._lock:
+            await self._launch()
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task:
+            self._health_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._health_task
+            self._health_task = None
+        async with self._lock:
+            await self._close_context()
+            if self._pw:
+                await self._pw.stop()
+                self._pw = None
+
+    async def _launch(self):
+        """Persistent context'i açar ve havuzu doldurur (tüm sayfalar aynı çerezleri kullanır)."""
+        if self._pw is None:
+            self._pw = await async_playwright().start()
+        ctx = await safe_launch(self._pw)
+        ctx.on("close", lambda _: self._on_context_closed(ctx))
+        if LEAN_MODE:
+            await ctx.route("**/*", block_heavy_resources)
+        self._ctx = ctx
+        # Kuyruk aynı kalır; bekleyen görevler yeni sayfaları alır
+        while not self._pages.empty():
+            self._pages.get_nowait()
+        existing = list(ctx.pages)
+        for i in range(self.pool_size):
+            page = existing[i] if i < len(existing) else await ctx.new_page()
+            self._pages.put_nowait(page)
+        self._healthy = True
+        print(f"🧭 Browser ready ({self.pool_size} pages).")
+
+    async def _close_context(self):
+        ctx, self._ctx = self._ctx, None
+        self._healthy = False
+        if ctx:
+            with contextlib.suppress(Exception):
+                await ctx.close()
+
+    def _on_context_closed(self, ctx):
+        if ctx is self._ctx:
+            self._healthy = False
+            print("⚠️ Browser closed unexpectedly, it will be restarted.")
+
+    async def _ping(self):
+        try:
+            await asyncio.wait_for(self._ctx.cookies(), timeout=10)
+            return True
+        except Exception:
+            return False
+
+    async def restart(self):
+        async with self._lock:
+            # Başka bir görev zaten yeniden başlattıysa tekrar başlatma
+            if self._ctx and self._healthy and await self._ping():
+                return
+            print("♻️ Restarting browser...")
+            await self._close_context()
+            await self._launch()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            if not self._healthy or not await self._ping():
+                try:
+                    await self.restart()
+                except Exception as e:
+                    print("⚠️ Browser restart failed:", e)
+
+    @contextlib.asynccontextmanager
+    async def page(self):
+        """Havuzdan bir sayfa ödünç verir; iş bitince sayfayı temizleyip geri koyar."""
+        if not self._healthy:
+            await self.restart()
+        page = await self._pages.get()
+        try:
+            yield page
+        finally:
+            await self._release(page)
+
+    async def _release(self, page):
+        # Yeniden başlatmadan önce alınmış sayfalar yeni havuza eklenmez
+        ctx = self._ctx
+        if ctx is None or page.context is not ctx:
+            return
+        try:
+            if page.is_closed():
+                raise PlaywrightError("page closed")
+            await page.goto("about:blank", timeout=5000)
+        except Exception:
+            with contextlib.suppress(Exception):
+                await page.close()
+            try:
+                page = await ctx.new_page()
+            except Exception:
+                self._healthy = False
+                return
+        self._pages.put_nowait(page)
+
+
+browser_service = BrowserService()
+
+
+# --- Adım süresi ölçümü ---
+class StepTimer:
+    """Bir işlemin adımlarının sürelerini toplar ve tek satırda yazdırır."""
+
+    def __init__(self, label):
+        self.label = label
+        self.start = self.last = time.monotonic()
+        self.steps = []
+
+    def mark(self, step):
+        now = time.monotonic()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+    def report(self):
+        steps = " ".join(f"{name}={seconds:.2f}s" for name, seconds in self.steps)
+        print(f"⏱️ {self.label}: {steps} total={time.monotonic() - self.start:.2f}s")
+
+
+# --- Tweet verisini GraphQL yanıtından oku ---
+def _is_tweet_graphql(response):
+    return "/graphql/" in response.url and ("TweetResultByRestId" in response.url or "TweetDetail" in response.url)
+
+
+def find_tweet_result(node, tweet_id: str):
+    """GraphQL yanıtı içinde rest_id'si tweet_id olan tweet nesnesini bulur."""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            if current.get("rest_id") == tweet_id and "legacy" in current:
+                return current
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+    return None
+
+
+def parse_tweet_result(result: dict) -> dict:
+    legacy = result["legacy"]
+    note = result.get("note_tweet", {}).get("note_tweet_results", {}).get("result", {})
+    if note.get("text"):
+        text = note["text"]
+    else:
+        # Baştaki @mention'ları ve sondaki medya linklerini at (aralık, HTML
+        # kaçışları çözülmüş metne göre verilir)
+        text = html.unescape(legacy.get("full_text", ""))
+        start, end = legacy.get("display_text_range", [0, len(text)])
+        text = text[start:end]
+    user = result.get("core", {}).get("user_results", {}).get("result", {})
+    return {
+        "id": result["rest_id"],
+        "text": text.strip(),
+        "author": user.get("core", {}).get("screen_name") or user.get("legacy", {}).get("screen_name"),
+        "created_at": legacy.get("created_at"),
+        "lang": legacy.get("lang"),
+        "metrics": {
+            "replies": legacy.get("reply_count"),
+            "retweets": legacy.get("retweet_count"),
+            "likes": legacy.get("favorite_count"),
+            "quotes": legacy.get("quote_count"),
+        },
+    }
+
+
+async def _tweet_from_response(response, tweet_id: str):
+    try:
+        result = find_tweet_result(await response.json(), tweet_id)
+        return parse_tweet_result(result) if result else None
+    except Exception as e:
+        print("⚠️ Tweet GraphQL parse error:", e)
+        return None
+
+
+async def _tweet_from_dom(page, tweet_id: str):
+    # Önce linki bu tweete giden kartı, bulunamazsa ilk metni dene
+    focal = page.locator(f"article:has(a[href*='/status/{tweet_id}']) div[data-testid='tweetText']")
+    tweet_texts = await focal.all_inner_texts()
+    if not tweet_texts:
+        tweet_texts = await page.locator("article div[lang]").all_inner_texts()
+    if not tweet_texts:
+        return None
+    return {"id": tweet_id, "text": tweet_texts[0]}
+
+
+async def _wait_for_tweet(page, graphql):
+    """Tweet GraphQL yanıtı ya da tweet kartı (hangisi önce gelirse) hazır olana kadar bekler."""
+    article = asyncio.ensure_future(
+        page.locator("article").first.wait_for(state="visible", timeout=STEP_TIMEOUT_MS)
+    )
+    waiters = {article, graphql} if graphql is not None else {article}
+    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    if graphql is not None and graphql.done():
+        article.cancel()
+        return "network"
+    article.result()
+    with contextlib.suppress(PlaywrightError):
+        await page.locator("article div[lang]").first.wait_for(state="visible", timeout=2000)
+    return "dom"
+
+
+# --- Tweet'i çek (paylaşılan tarayıcı üzerinden) ---
+async def fetch_tweet(tweet_id: str):
+    """Tweet metnini ve (varsa) yazar/tarih/metrik bilgisini döndürür."""
     tweet_url = f"https://x.com/i/status/{tweet_id}"
+    timer = StepTimer(f"fetch {tweet_id}")
     try:
-        async with async_playwright() as pw:
-            browser = await safe_launch(pw)
-            page = await browser.new_page()
+        async with browser_service.page() as page:
+            timer.mark("page")
+            graphql = None
+            if LEAN_MODE:
+                graphql = asyncio.get_running_loop().create_future()
 
-            print(f"🌐 Opening tweet: {tweet_url}")
-            await page.goto(tweet_url, timeout=60000)
-            await page.wait_for_timeout(6000)
+                def on_response(response):
+                    if not graphql.done() and _is_tweet_graphql(response):
+                        graphql.set_result(response)
 
-            tweet_texts = await page.locator("article div[lang]").all_inner_texts()
-            await browser.close()
+                page.on("response", on_response)
 
-            if tweet_texts:
-                print("✅ Tweet text fetched.")
-                return tweet_texts[0]
-            else:
-                print("⚠️ Could not find tweet text.")
-                return None
+            try:
+                print(f"🌐 Opening tweet: {tweet_url}")
+                ready = None
+                if WAIT_MODE == "fixed":
+                    await page.goto(tweet_url, timeout=60000)
+                    timer.mark("goto")
+                    await page.wait_for_timeout(6000)
+                    timer.mark("sleep")
+                else:
+                    # Sabit bekleme yerine tweet verisi ya da kartı gelene kadar bekle
+                    await page.goto(tweet_url, wait_until="domcontentloaded", timeout=60000)
+                    timer.mark("goto")
+                    ready = await _wait_for_tweet(page, graphql)
+                    timer.mark(ready)
+
+                tweet = None
+                if graphql is not None and graphql.done():
+                    tweet = await _tweet_from_response(graphql.result(), tweet_id)
+                if tweet is None:
+                    # GraphQL yanıtı kart çizilmeden gelmiş olabilir, DOM'dan okumadan önce kartı bekle
+                    if ready == "network":
+                        with contextlib.suppress(PlaywrightError):
+                            await page.locator("article").first.wait_for(state="visible", timeout=STEP_TIMEOUT_MS)
+                    tweet = await _tweet_from_dom(page, tweet_id)
+                timer.mark("parse")
+            finally:
+                if LEAN_MODE:
+                    page.remove_listener("response", on_response)
+
+        if tweet and tweet["text"]:
+            print("✅ Tweet text fetched.")
+            return tweet
+        else:
+            print("⚠️ Could not find tweet text.")
+            return None
     except Exception as e:
         print("⚠️ Tweet fetch error:", e)
         return None
+    finally:
+        timer.report()
 
 
-# --- Cevap üret ---
-def generate_reply_with_sentient(tweet_text: str) -> str:
-    try:
-        lang = detect(tweet_text)
-    except:
-        lang = "en"
-
-    persona = (
-        "You are Dobby — a witty, confident but respectful community member created by Revenes. "
-        "Your humor is subtle, intelligent and slightly sarcastic, never rude. "
-        "You never use profanity, slang or offensive language. "
-        "You answer with calm confidence, thoughtful irony, and a clean tone. "
-        "You sound like a chill person who’s been online for years and knows when to be clever or insightful. "
-        "Your replies are concise (max 200 chars), human-like, and shareable."
-    )
+async def fetch_tweet_text(tweet_id: str):
+    tweet = await fetch_tweet(tweet_id)
+    return tweet["text"] if tweet else None
+
+
+# --- Dil tespiti ---
+# langdetect sabit tohumla deterministik sonuç verir
+DetectorFactory.seed = 0
+
+# Yalnızca Türkçede geçen harfler (ç, ö, ü başka dillerde de var)
+TURKISH_ONLY_CHARS = set("ğĞışŞİ")
+TURKISH_CHARS = TURKISH_ONLY_CHARS | set("çÇöÖüÜ")
+TURKISH_WORDS = {
+    "ve", "bir", "bu", "da", "de", "mi", "mı", "ne", "çok", "için", "ama", "gibi",
+    "daha", "ile", "ben", "sen", "biz", "değil", "var", "yok", "şu", "o", "ki", "diye"
+}
+ENGLISH_WORDS = {
+    "the", "and", "is", "are", "a", "an", "of", "to", "in", "it", "that", "this",
+    "for", "on", "with", "you", "i", "we", "be", "not", "just", "so", "what"
+}
+SHORT_TEXT_WORDS = 12
+WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+class LanguageDetector:
+    """
+    langdetect'i önbellekli ve hızlı yollu kullanır. Kısa metinlerde Türkçe /
+    İngilizce ayrımı karakter ve kelime sezgisiyle yapılır, sonuçlar metnin
+    hash'ine göre saklanır.
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def warm_up(self):
+        """Dil profillerini önceden yükler (ilk çağrı yüzlerce ms sürer)."""
+        self._detect("Warming up the language detector.")
+
+    def detect(self, text: str) -> str:
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        lang = self._cache.get(key)
+        if lang is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return lang
+
+        self.misses += 1
+        lang = self._fast_path(text) or self._detect(text)
+        self._cache[key] = lang
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return lang
+
+    @staticmethod
+    def _fast_path(text: str):
+        """
+        Türkçeye özgü harfler varsa ya da kısa metnin en az yarısı sık
+        kelimelerse sonucu döner, yoksa karar langdetect'e bırakılır
+        (Türkçe çoğu zaman ASCII harflerle de yazılır).
+        """
+        if any(ch in TURKISH_ONLY_CHARS for ch in text):
+            return "tr"
+        words = [word.lower() for word in WORD_RE.findall(text)]
+        if not words or len(words) > SHORT_TEXT_WORDS:
+            return None
+        turkish = sum(word in TURKISH_WORDS for word in words) + any(ch in TURKISH_CHARS for ch in text)
+        english = sum(word in ENGLISH_WORDS for word in words)
+        # Sık kelimeler metnin en az yarısını tutmuyorsa kanıt zayıf sayılır
+        if max(turkish, english) * 2 < len(words):
+            return None
+        if turkish > english:
+            return "tr"
+        if english > turkish:
+            return "en"
+        return None
+
+    @staticmethod
+    def _detect(text: str) -> str:
+        try:
+            return detect(text)
+        except:
+            return "en"
+
+
+language_detector = LanguageDetector()
 
+
+def detect_language(tweet_text: str) -> str:
+    return language_detector.detect(tweet_text)
+
+
+def benchmark_language_detection(rounds: int = 200):
+    """Dil tespiti için çağrı başına gecikmeyi ölçer (python telegram_auto_reply_bot.py --bench-langdetect)."""
+    samples = [
+        "gm",
+        "This is huge for rollups, fees are finally going down.",
+        "Bugün piyasa çok sakin, herkes bekliyor.",
+        "Bence bu proje daha çok yol alacak ama ekip sessiz.",
+        "Honestly the most underrated thread I have read this week about modular blockchains and data availability.",
+        "Yeni güncelleme ile birlikte işlem ücretleri ciddi şekilde düştü, topluluk da oldukça memnun görünüyor.",
+    ]
+
+    def per_call(fn, texts):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                fn(text)
+        return (time.perf_counter() - started) / (rounds * len(texts)) * 1000
+
+    started = time.perf_counter()
+    LanguageDetector._detect(samples[1])
+    print(f"cold start (profile load): {(time.perf_counter() - started) * 1000:8.3f} ms")
+
+    print(f"langdetect per call:       {per_call(LanguageDetector._detect, samples):8.3f} ms")
+    fast_samples = [text for text in samples if LanguageDetector._fast_path(text)]
+    print(f"fast path per call:        {per_call(LanguageDetector._fast_path, fast_samples):8.3f} ms ({len(fast_samples)}/{len(samples)} samples)")
+    detector = LanguageDetector()
+    for text in samples:
+        detector.detect(text)
+    print(f"cached per call:           {per_call(detector.detect, samples):8.3f} ms")
+    for text in samples:
+        print(f"  {detector.detect(text)}  {text[:60]}")
+
+
+# --- Cevap üret ---
+PERSONA = (
+    "You are Dobby — a witty, confident but respectful community member created by Revenes. "
+    "Your humor is subtle, intelligent and slightly sarcastic, never rude. "
+    "You never use profanity, slang or offensive language. "
+    "You answer with calm confidence, thoughtful irony, and a clean tone. "
+    "You sound like a chill person who’s been online for years and knows when to be clever or insightful. "
+    "Your replies are concise (max 200 chars), human-like, and shareable."
+)
+
+BATCH_REPLY_INSTRUCTIONS = (
+    f"{PERSONA}\n\n"
+    "Write a short, witty, and natural reply to each tweet below. "
+    "Keep it subtly sarcastic, never rude or offensive. "
+    "Reply in TURKISH to tweets whose language is \"tr\", and in ENGLISH to all others."
+)
+
+FALLBACKS_TR = [
+    "İronik bir tespit, hoşuma gitti.",
+    "Kesinlikle düşünmeye değer bir yorum.",
+    "Sade ama zekice yazılmış.",
+    "Kısa ama etkili bir düşünce.",
+    "Güzel bakış açısı, beğendim."
+]
+FALLBACKS_EN = [
+    "Smart take, I like it.",
+    "Short but clever.",
+    "That’s actually a good point.",
+    "Simple, yet on point.",
+    "I see what you did there."
+]
+
+
+def build_reply_prompt(tweet_text: str, lang: str) -> str:
     if lang.startswith("tr"):
-        prompt = (
-            f"{persona}\n\n"
+        return (
+            f"{PERSONA}\n\n"
             "Aşağıdaki tweete kısa, zeki ve doğal bir yanıt yaz. "
             "Tonun hafif alaycı, samimi ve saygılı olsun. "
             "Küfür, argo, aşırı şaka ya da küçümseme yok. "
-            "Cevabı TÜRKÇE yaz. Maksimum 220 karakter.\n\n"
-            f"TWEET:\n{tweet_text.strip()}\n"
-        )
-    else:
-        prompt = (
-            f"{persona}\n\n"
-            "Write a short, witty, and natural reply to the tweet below. "
-            "Keep it subtly sarcastic, never rude or offensive. "
-            "Respond in ENGLISH. Max 220 characters.\n\n"
+            f"Cevabı TÜRKÇE yaz. Maksimum {REPLY_MAX_CHARS} karakter.\n\n"
             f"TWEET:\n{tweet_text.strip()}\n"
         )
+    return (
+        f"{PERSONA}\n\n"
+        "Write a short, witty, and natural reply to the tweet below. "
+        "Keep it subtly sarcastic, never rude or offensive. "
+        f"Respond in ENGLISH. Max {REPLY_MAX_CHARS} characters.\n\n"
+        f"TWEET:\n{tweet_text.strip()}\n"
+    )
+
 
+def clean_reply(out: str) -> str:
+    reply = (out or "").strip()
+    if (reply.startswith('"') and reply.endswith('"')) or (reply.startswith("'") and reply.endswith("'")):
+        reply = reply[1:-1].strip()
+    return reply[:REPLY_MAX_CHARS]
+
+
+def fallback_reply(lang: str) -> str:
+    return random.choice(FALLBACKS_TR if lang.startswith("tr") else FALLBACKS_EN)
+
+
+async def generate_reply_with_sentient(tweet_text: str) -> str:
+    lang = detect_language(tweet_text)
     if sentient_model:
         try:
-            out = sentient_model.query(prompt)
-            reply = (out or "").strip()
-            if (reply.startswith('"') and reply.endswith('"')) or (reply.startswith("'") and reply.endswith("'")):
-                reply = reply[1:-1].strip()
-            return reply[:220]
+            # Üretim karakter sınırına ulaşınca durdurulur
+            out = await sentient_model.aquery(build_reply_prompt(tweet_text, lang), max_chars=REPLY_MAX_CHARS)
+            reply = clean_reply(out)
+            if reply:
+                return reply
         except Exception as e:
             print("⚠️ Sentient query error:", e)
+    return fallback_reply(lang)
+
+
+async def generate_replies_with_sentient(tweets: dict) -> dict:
+    """Birden fazla tweete tek model çağrısıyla yanıt üretir (tweet_id -> yanıt)."""
+    langs = {tweet_id: detect_language(text) for tweet_id, text in tweets.items()}
+    replies = {}
+    if sentient_model:
+        try:
+            # Persona bir kez gönderilir; ayrıştırılamayan yanıtlar tek tek üretilir
+            items = [
+                {"id": tweet_id, "language": "tr" if langs[tweet_id].startswith("tr") else "en", "text": text.strip()}
+                for tweet_id, text in tweets.items()
+            ]
+            out = await sentient_model.aquery_batch(
+                BATCH_REPLY_INSTRUCTIONS,
+                items,
+                max_chars=REPLY_MAX_CHARS,
+                item_prompt=lambda item: build_reply_prompt(item["text"], langs[item["id"]])
+            )
+            replies = {tweet_id: clean_reply(reply) for tweet_id, reply in out.items()}
+        except Exception as e:
+            print("⚠️ Sentient batch query error:", e)
+    return {tweet_id: replies.get(tweet_id) or fallback_reply(langs[tweet_id]) for tweet_id in tweets}
 
-    fallbacks_tr = [
-        "İronik bir tespit, hoşuma gitti.",
-        "Kesinlikle düşünmeye değer bir yorum.",
-        "Sade ama zekice yazılmış.",
-        "Kısa ama etkili bir düşünce.",
-        "Güzel bakış açısı, beğendim."
-    ]
-    fallbacks_en = [
-        "Smart take, I like it.",
-        "Short but clever.",
-        "That’s actually a good point.",
-        "Simple, yet on point.",
-        "I see what you did there."
-    ]
-    return random.choice(fallbacks_tr if lang.startswith("tr") else fallbacks_en)
 
+# --- Tweet'e yanıt gönder (paylaşılan tarayıcı üzerinden) ---
+ENABLED_TWEET_BUTTON = (
+    "[data-testid='tweetButtonInline']:not([aria-disabled='true']), "
+    "[data-testid='tweetButton']:not([aria-disabled='true'])"
+)
 
-# --- Tweet'e yanıt gönder ---
-async def post_reply_via_playwright(tweet_id: str, reply_text: str):
-    from playwright.sync_api import sync_playwright
+
+def _is_create_tweet(response):
+    return "CreateTweet" in response.url and response.request.method == "POST"
+
+
+async def post_reply_via_playwright(tweet_id: str, reply_text: str) -> bool:
+    """Yanıtı paylaşır; paylaşımın onaylanıp onaylanmadığını döndürür."""
     intent_url = f"https://twitter.com/intent/tweet?in_reply_to={tweet_id}"
+    timer = StepTimer(f"post {tweet_id}")
 
-    def _post():
-        with sync_playwright() as pw:
-            ctx = pw.chromium.launch_persistent_context(
-                os.path.expanduser(PROFILE_DIR),
-                headless=HEADLESS,
-                args=[
-                    "--disable-blink-features=AutomationControlled",
-                    "--no-sandbox",
-                    "--disable-gpu",
-                    "--disable-dev-shm-usage",
-                    "--use-gl=swiftshader",
-                    "--disable-software-rasterizer",
-                ],
-            )
-            page = ctx.new_page()
-            page.goto(intent_url, wait_until="domcontentloaded")
-            page.wait_for_timeout(3000)
-            try:
-                box = page.locator("div[role='textbox']").first
-                box.wait_for(state="visible", timeout=15000)
-                box.click()
-                try:
-                    page.keyboard.press("Meta+A")
-                except:
-                    page.keyboard.press("Control+A")
-                page.keyboard.press("Backspace")
-                page.keyboard.type(reply_text, delay=20)
-
-                for _ in range(30):
-                    btn = page.locator("div[data-testid='tweetButtonInline'], div[data-testid='tweetButton']")
-                    if btn.count() > 0 and (btn.get_attribute("aria-disabled") in [None, "false"]):
-                        btn.first.click()
-                        print("✅ Reply button clicked.")
-                        break
-                    page.wait_for_timeout(200)
-
-                page.keyboard.press("Meta+Enter")
-                page.wait_for_timeout(1000)
-                page.keyboard.press("Control+Enter")
-                page.wait_for_timeout(4000)
+    async with browser_service.page() as page:
+        timer.mark("page")
+        try:
+            if WAIT_MODE == "fixed":
+                return await _post_with_fixed_waits(page, intent_url, reply_text, timer)
+
+            await page.goto(intent_url, wait_until="domcontentloaded")
+            timer.mark("goto")
+            box = page.locator("div[role='textbox']").first
+            await box.wait_for(state="visible", timeout=STEP_TIMEOUT_MS)
+            timer.mark("textbox")
+
+            # Metni karakter karakter yazmak yerine tek seferde ekle
+            await box.click()
+            await page.keyboard.press("ControlOrMeta+A")
+            await page.keyboard.press("Backspace")
+            await page.keyboard.insert_text(reply_text)
+            timer.mark("insert")
+
+            enabled_button = page.locator(ENABLED_TWEET_BUTTON).first
+            await enabled_button.wait_for(state="visible", timeout=STEP_TIMEOUT_MS)
+            timer.mark("button")
+
+            # Paylaşım, CreateTweet isteğinin yanıtı ile doğrulanır
+            async with page.expect_response(_is_create_tweet, timeout=STEP_TIMEOUT_MS) as response_info:
+                await enabled_button.click()
+            response = await response_info.value
+            body = await response.json() if response.ok else {}
+            timer.mark("confirm")
+
+            if response.ok and not body.get("errors"):
                 print("✅ Reply successfully sent.")
-            except Exception as e:
-                print("⚠️ Reply send error:", e)
-            finally:
-                if HEADLESS:
-                    ctx.close()
+                return True
+            print(f"⚠️ Reply was rejected (HTTP {response.status}): {body.get('errors')}")
+            return False
+        except Exception as e:
+            print("⚠️ Reply send error:", e)
+            return False
+        finally:
+            timer.report()
+
+
+async def _post_with_fixed_waits(page, intent_url, reply_text, timer):
+    """Eski davranış: sabit beklemeler ve karakter karakter yazma (WAIT_MODE=fixed)."""
+    await page.goto(intent_url, wait_until="domcontentloaded")
+    await page.wait_for_timeout(3000)
+    timer.mark("goto")
+    box = page.locator("div[role='textbox']").first
+    await box.wait_for(state="visible", timeout=15000)
+    await box.click()
+    try:
+        await page.keyboard.press("Meta+A")
+    except:
+        await page.keyboard.press("Control+A")
+    await page.keyboard.press("Backspace")
+    await page.keyboard.type(reply_text, delay=20)
+    timer.mark("type")
+
+    for _ in range(30):
+        btn = page.locator("div[data-testid='tweetButtonInline'], div[data-testid='tweetButton']")
+        if await btn.count() > 0 and (await btn.first.get_attribute("aria-disabled") in [None, "false"]):
+            await btn.first.click()
+            print("✅ Reply button clicked.")
+            break
+        await page.wait_for_timeout(200)
+    timer.mark("button")
+
+    await page.keyboard.press("Meta+Enter")
+    await page.wait_for_timeout(1000)
+    await page.keyboard.press("Control+Enter")
+    await page.wait_for_timeout(4000)
+    timer.mark("sleep")
+    print("✅ Reply successfully sent.")
+    return True
+
+
+# --- Sıralı ve aralıklı paylaşım (tek hesap) ---
+fetch_semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+generate_semaphore = asyncio.Semaphore(GENERATE_CONCURRENCY)
+post_lock = asyncio.Lock()
+last_post_at = 0.0
+
+
+class ReplyBatcher:
+    """
+    Kısa bir süre içinde (GENERATE_BATCH_WINDOW) üretim aşamasına gelen
+    tweetleri toplayıp tek model çağrısında yanıtlar.
+    """
+
+    def __init__(self, max_size: int, window: float):
+        self.max_size = max_size
+        self.window = window
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def generate(self, tweet_id: str, tweet_text: str) -> str:
+        if self.max_size <= 1:
+            async with generate_semaphore:
+                return await generate_reply_with_sentient(tweet_text)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((tweet_id, tweet_text, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            async with generate_semaphore:
+                replies = await generate_replies_with_sentient({tweet_id: text for tweet_id, text, _ in batch})
+            for tweet_id, _, future in batch:
+                if not future.done():
+                    future.set_result(replies.get(tweet_id))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+reply_batcher = ReplyBatcher(GENERATE_BATCH_SIZE, GENERATE_BATCH_WINDOW)
+
+
+async def post_reply_paced(tweet_id: str, reply_text: str):
+    """Yanıtları hesap başına tek tek ve en az POST_INTERVAL saniye arayla paylaşır."""
+    global last_post_at
+    async with post_lock:
+        wait = last_post_at + POST_INTERVAL - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            return await post_reply_via_playwright(tweet_id, reply_text)
+        finally:
+            last_post_at = time.monotonic()
+
 
-    await asyncio.to_thread(_post)
+# --- Tek tweet için işlem hattı: çek -> üret -> paylaş ---
+async def process_tweet(msg, i, total, tweet_id, previous_done, done):
+    try:
+        async with fetch_semaphore:
+            await msg.reply_text(f"📖 [{i}/{total}] Tweet alınıyor...")
+            ttext = await fetch_tweet_text(tweet_id)
+        if not ttext:
+            await msg.reply_text(f"⚠️ [{i}/{total}] Tweet alınamadı (silinmiş veya gizli olabilir).")
+            return
+
+        reply = await reply_batcher.generate(tweet_id, ttext)
+        if not reply:
+            await msg.reply_text(f"⚠️ [{i}/{total}] Cevap üretilemedi.")
+            return
+
+        if AUTO_POST:
+            # Mesajdaki sırayı korumak için önceki tweetin paylaşılmasını bekle
+            await previous_done.wait()
+            await msg.reply_text(f"💬 [{i}/{total}] Yanıt gönderiliyor...")
+            if await post_reply_paced(tweet_id, reply):
+                await msg.reply_text(f"✅ [{i}/{total}] Yanıt gönderildi:\n{reply}")
+            else:
+                await msg.reply_text(f"⚠️ [{i}/{total}] Yanıt gönderilemedi:\n{reply}")
+        else:
+            intent = f"https://twitter.com/intent/tweet?in_reply_to={tweet_id}&text={urllib.parse.quote(reply)}"
+            await msg.reply_text(f"💡 [{i}/{total}] Önerilen yanıt:\n{reply}\n\nElle paylaş: {intent}")
+    except Exception as e:
+        print(f"⚠️ Tweet {tweet_id} processing error:", e)
+        await msg.reply_text(f"⚠️ [{i}/{total}] İşlem başarısız oldu.")
+    finally:
+        done.set()
 
 
 # --- Telegram mesaj işleyici ---
@@ -217,31 +815,32 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not tweet_matches:
         return
 
-    await msg.reply_text(f"🔍 {len(tweet_matches)} tweet bulundu. İşlem başlatılıyor...")
+    # Aynı tweet mesajda birden fazla geçiyorsa yalnızca bir kez işle
+    tweet_ids = list(dict.fromkeys(tweet_id for _, tweet_id in tweet_matches))
+    total = len(tweet_ids)
 
-    for i, match in enumerate(tweet_matches, start=1):
-        tweet_url, tweet_id = match
-        await msg.reply_text(f"📖 [{i}/{len(tweet_matches)}] Tweet alınıyor...")
+    await msg.reply_text(f"🔍 {total} tweet bulundu. İşlem başlatılıyor...")
 
-        ttext = await fetch_tweet_text(tweet_id)
-        if not ttext:
-            await msg.reply_text(f"⚠️ [{i}] Tweet alınamadı (silinmiş veya gizli olabilir).")
-            continue
+    # Tweetler paralel çekilir ve üretilir, paylaşım ise sırayla yapılır
+    first_turn = asyncio.Event()
+    first_turn.set()
+    turns = [first_turn] + [asyncio.Event() for _ in tweet_ids]
+    await asyncio.gather(*(
+        process_tweet(msg, i, total, tweet_id, turns[i - 1], turns[i])
+        for i, tweet_id in enumerate(tweet_ids, start=1)
+    ))
 
-        reply = generate_reply_with_sentient(ttext)
-        if not reply:
-            await msg.reply_text(f"⚠️ [{i}] Cevap üretilemedi.")
-            continue
+    await msg.reply_text("🎯 Tüm tweetler işlendi.")
 
-        if AUTO_POST:
-            await msg.reply_text(f"💬 [{i}] Yanıt gönderiliyor...")
-            await post_reply_via_playwright(tweet_id, reply)
-            await msg.reply_text(f"✅ [{i}] Yanıt gönderildi:\n{reply}")
-        else:
-            intent = f"https://twitter.com/intent/tweet?in_reply_to={tweet_id}&text={urllib.parse.quote(reply)}"
-            await msg.reply_text(f"💡 [{i}] Önerilen yanıt:\n{reply}\n\nElle paylaş: {intent}")
 
-    await msg.reply_text("🎯 Tüm tweetler işlendi.")
+# --- Bot açılış / kapanış ---
+async def on_startup(app):
+    await asyncio.to_thread(language_detector.warm_up)
+    await browser_service.start()
+
+
+async def on_shutdown(app):
+    await browser_service.stop()
 
 
 # --- Ana fonksiyon ---
@@ -250,7 +849,14 @@ def main():
         print("❌ TELEGRAM_BOT_TOKEN missing (add it to '.env').")
         return
 
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(True)
+        .build()
+    )
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     print("🤖 Dobby is online. Mention @Sentius_Dobby_Bot with a tweet link.")
@@ -258,4 +864,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    if "--bench-langdetect" in sys.argv[1:]:
+        benchmark_language_detection()
+    else:
+        main()